@@ -147,11 +147,11 @@ class UserLoginForm(AuthenticationForm):
         """
         检查用户登录终端UUID
         """
-        terminal_obj = queryset_cache.base_LoginTerminal.filter(user=user).first()
-        if terminal_obj is not None:
-            if terminal_obj.is_enabled:
+        terminal = queryset_cache.base_LoginTerminal.get_cached(user_id=user.pk)
+        if terminal is not None:
+            if terminal['is_enabled']:
                 terminal_uuid = self.cleaned_data.get('terminal_uuid')
-                if terminal_obj.terminal_address != terminal_uuid:
+                if terminal['terminal_address'] != terminal_uuid:
                     raise forms.ValidationError(
                         self.extra_messages['login_terminal_blocked'],
                         code='login_terminal_blocked', params={'addr': terminal_uuid}
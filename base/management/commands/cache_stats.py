@@ -0,0 +1,49 @@
+"""
+Dump the hottest and largest cache keys recorded by common.core.cache_metrics
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from common.core.cache_metrics import SharedCacheSink, get_sink
+
+
+class Command(BaseCommand):
+    help = 'Show the top-N hottest and largest cache key prefixes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--top', type=int, default=10,
+                            help='Number of key prefixes to show, defaults to 10.')
+        parser.add_argument('--reset', action='store_true',
+                            help='Reset all recorded metrics after showing them.')
+
+    def _write_table(self, rows):
+        self.stdout.write('  %-40s %10s %10s %9s %12s %12s' % (
+            'prefix', 'hits', 'misses', 'hit rate', 'avg refill', 'size'))
+        for prefix, item in rows:
+            hit_rate = '-' if item['hit_rate'] is None else '%.1f%%' % (item['hit_rate'] * 100)
+            avg_refill = '-' if item['avg_refill_time'] is None else '%.1fms' % (item['avg_refill_time'] * 1000)
+            self.stdout.write('  %-40s %10d %10d %9s %12s %12d' % (
+                prefix[:40], item['hits'], item['misses'], hit_rate, avg_refill, item['size']))
+
+    def handle(self, *args, **options):
+        sink = get_sink()
+        if sink is None:
+            raise CommandError('Cache metrics are disabled, check CACHE_METRICS_SINK in settings.')
+        if not isinstance(sink, SharedCacheSink):
+            self.stdout.write(self.style.WARNING(
+                'Only metrics of this process are shown, set CACHE_METRICS_SINK to '
+                'common.core.cache_metrics.SharedCacheSink to aggregate all processes.'))
+        summary = sink.summary()
+        top = options['top']
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Hottest keys:'))
+        hottest = sorted(summary.items(), key=lambda x: x[1]['hits'] + x[1]['misses'], reverse=True)
+        self._write_table(hottest[:top])
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Largest keys:'))
+        largest = sorted(summary.items(), key=lambda x: x[1]['size'], reverse=True)
+        self._write_table(largest[:top])
+
+        if options['reset']:
+            sink.reset()
+            self.stdout.write('  Cache metrics reset... ' + self.style.SUCCESS('OK'))
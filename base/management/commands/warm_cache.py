@@ -0,0 +1,79 @@
+"""
+Pre-populate caches after deploying or flushing redis (see tools/clean_redis.py)
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from base.models import User
+from common.backends.user import (
+    PERMISSION_INDEX, load_permissions, load_permission_index, permission_cache)
+from common.core.cache import queryset_cache
+
+
+class Command(BaseCommand):
+    help = 'Refill the declared QuerySetCache entries, the permission index and permissions of active users.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-w', '--workers', type=int, default=4,
+                            help='Number of concurrent threads, defaults to 4.')
+        parser.add_argument('-b', '--batch-size', type=int, default=500,
+                            help='Number of users whose permissions are loaded per query, defaults to 500.')
+        parser.add_argument('--skip-permissions', action='store_true',
+                            help='Do not warm permissions of users.')
+
+    @staticmethod
+    def _timed(func, *args):
+        start = time.monotonic()
+        try:
+            func(*args)
+        finally:
+            # every thread opens its own database connections
+            connections.close_all()
+        return time.monotonic() - start
+
+    @staticmethod
+    def _warm_permissions(user_ids):
+        perms = load_permissions(user_ids)
+        permission_cache.set_many({str(user_id): value for user_id, value in perms.items()})
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING('Warming cache:'))
+        start = time.monotonic()
+        tasks = dict()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            # only the models declared in QuerySetCache, never whole unrelated tables
+            for name in queryset_cache.__dir__():
+                # 0 means that model will never be cached
+                if queryset_cache._named_mappings[name] != 0:
+                    tasks[executor.submit(self._timed, queryset_cache.refill, name)] = name
+
+            if not options['skip_permissions']:
+                # superusers have all permissions of the index
+                tasks[executor.submit(
+                    self._timed, permission_cache.set, PERMISSION_INDEX, load_permission_index
+                )] = 'permission index'
+                user_ids = list(User.objects.filter(
+                    is_active=True, is_superuser=False).values_list('pk', flat=True))
+                batch_size = options['batch_size']
+                for i in range(0, len(user_ids), batch_size):
+                    batch = user_ids[i:i + batch_size]
+                    name = 'permissions of %d users' % len(batch)
+                    tasks[executor.submit(self._timed, self._warm_permissions, batch)] = name
+
+            failed = 0
+            for future in as_completed(tasks):
+                name = tasks[future]
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stdout.write('  Warming %s... ' % name + self.style.ERROR(str(e)))
+                else:
+                    self.stdout.write('  Warming %s... ' % name + self.style.SUCCESS('OK') +
+                                      ' (%.1fms)' % (seconds * 1000))
+
+        summary = '  %d warmed, %d failed in %.2fs' % (len(tasks) - failed, failed, time.monotonic() - start)
+        self.stdout.write(self.style.WARNING(summary) if failed else summary)
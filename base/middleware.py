@@ -1,5 +1,7 @@
 from django.utils.deprecation import MiddlewareMixin
 
+from common.core import presence
+
 
 class AccessControlMiddleware(MiddlewareMixin):
 
@@ -9,7 +11,7 @@ class AccessControlMiddleware(MiddlewareMixin):
 
     def __call__(self, request):
         if request.user.is_authenticated:
-            ...
+            presence.touch(request.user.pk)
         response = self.get_response(request)
         return response
 
@@ -1,2 +1,10 @@
-from .role import RoleViewBaseTests, RoleViewFeatureTests, RoleModelTests
-from .user import UserViewTests, UserModelTests
+from .role import RoleViewBaseTests, RoleViewFeatureTests, RoleModelTests, RoleTransactionTests, PermissionIndexTests
+from .user import UserViewTests, UserModelTests, UserPresenceTests
+from .serialization import JsonEncoderTests, RowConverterTests, NormalizeTests
+from .cache import (
+    SingleFlightTests, CachedRowsTests, LocalCacheTests, QuerySetCacheTests, ModelBasedCacheBatchTests,
+    CacheMetricsTests, CacheCodecTests)
+from .paginator import CursorPaginatorTests, MongoCursorPaginatorTests
+from .list_view import FilterSchemaTests, CountStrategyTests, StreamingResponseTests
+from .permission import PermissionViewTests
+from .commands import WarmCacheCommandTests, CacheStatsCommandTests
@@ -0,0 +1,429 @@
+import threading
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils.crypto import get_random_string
+
+from common.core import cache_metrics
+from common.core.cache_codecs import PickleCodec, RowsCodec, ZlibCodec
+from common.core.cache import (
+    LOCAL_GENERATION_KEY, CachedRows, GenericBasedCache, LocalCache, ModelBasedCache, _missing,
+    _single_flight_get, _store, get_local_cache, queryset_cache)
+from common.test import TestMixin
+
+
+class CacheTestMixin:
+
+    def setUp(self):
+        super().setUp()
+        # keys of this test only
+        self.key = 'test_cache_%s' % get_random_string()
+
+    def tearDown(self):
+        cache.delete_many([self.key, self.key + '_lock'])
+        super().tearDown()
+
+    @staticmethod
+    def _counting_loader(value):
+        def loader():
+            loader.calls += 1
+            return value
+        loader.calls = 0
+        return loader
+
+
+class SingleFlightTests(CacheTestMixin, TestCase):
+
+    def test_load_once(self):
+        """
+        缓存不存在时只调用一次loader，之后命中缓存
+        """
+        loader = self._counting_loader('value')
+        for _ in range(3):
+            self.assertEqual(_single_flight_get(cache, self.key, loader, 60), 'value')
+        self.assertEqual(loader.calls, 1)
+        self.assertIsNone(cache.get(self.key + '_lock'), '回填后释放锁')
+
+    def test_wait_for_lock_holder(self):
+        """
+        其他进程持有锁时等待其回填的结果，不再调用loader
+        """
+        cache.add(self.key + '_lock', 1, 10)
+        timer = threading.Timer(0.1, _store, args=(cache, self.key, 'refilled', 0, 60))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        loader = self._counting_loader('value')
+        self.assertEqual(_single_flight_get(cache, self.key, loader, 60), 'refilled')
+        self.assertEqual(loader.calls, 0)
+
+    def test_lock_released_when_loader_fails(self):
+        """
+        loader出错时释放锁，不会阻塞其他进程
+        """
+        def loader():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            _single_flight_get(cache, self.key, loader, 60)
+        self.assertIsNone(cache.get(self.key + '_lock'))
+
+    def test_early_recomputation(self):
+        """
+        XFetch：随机数足够大时在过期前提前刷新，否则使用缓存值
+        """
+        _store(cache, self.key, 'old', 1000, 60)
+        loader = self._counting_loader('new')
+        with mock.patch('common.core.cache.random.random', return_value=0.0):
+            # -log(1) = 0, never earlier than expiry
+            self.assertEqual(_single_flight_get(cache, self.key, loader, 60), 'old')
+        with mock.patch('common.core.cache.random.random', return_value=0.99):
+            # 1000 * -log(0.01) is far beyond expiry
+            self.assertEqual(_single_flight_get(cache, self.key, loader, 60), 'new')
+        self.assertEqual(loader.calls, 1)
+
+    def test_early_recomputation_by_one_worker(self):
+        """
+        其他进程正在提前刷新时，直接返回当前缓存值
+        """
+        _store(cache, self.key, 'old', 1000, 60)
+        cache.add(self.key + '_lock', 1, 10)
+        loader = self._counting_loader('new')
+        with mock.patch('common.core.cache.random.random', return_value=0.99):
+            self.assertEqual(_single_flight_get(cache, self.key, loader, 60), 'old')
+        self.assertEqual(loader.calls, 0)
+
+    def test_generic_based_cache(self):
+        """
+        GenericBasedCache开启single_flight后通过default回填，set后直接返回新值
+        """
+        generic_cache = GenericBasedCache(self.key, timeout=60, single_flight=True)
+        loader = self._counting_loader('value')
+        self.assertEqual(generic_cache.get(loader), 'value')
+        self.assertEqual(generic_cache.get(loader), 'value')
+        self.assertEqual(loader.calls, 1)
+        generic_cache.set('changed')
+        self.assertEqual(generic_cache.get(loader), 'changed')
+
+
+class CachedRowsTests(TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.rows = CachedRows(('id', 'user_id', 'name'), [(1, 10, 'a'), (2, 10, 'b'), (3, 20, 'c')],
+                               index_by=('user_id',))
+
+    def test_filter_cached(self):
+        """
+        按索引字段和非索引字段查询
+        """
+        self.assertEqual([row['id'] for row in self.rows.filter_cached(user_id=10)], [1, 2])
+        self.assertEqual(self.rows.filter_cached(user_id=10, name='b'), [{'id': 2, 'user_id': 10, 'name': 'b'}])
+        self.assertEqual(self.rows.filter_cached(name='c')[0]['id'], 3)
+        self.assertEqual(self.rows.filter_cached(user_id=30), [])
+        self.assertEqual(self.rows.get_cached(user_id=20)['name'], 'c')
+        self.assertIsNone(self.rows.get_cached(user_id=30))
+        self.assertEqual(len(self.rows.values()), 3)
+
+    def test_filter_cached_unknown_field(self):
+        """
+        查询未缓存的字段时报错
+        """
+        with self.assertRaises(LookupError):
+            self.rows.filter_cached(email='a@example.com')
+
+    def test_materialized_model_cache(self):
+        """
+        materialize的缓存为CachedRows，查询时不再访问数据库，数据变动后自动失效
+        """
+        user = self._create_user()
+        model_cache = ModelBasedCache(get_user_model(), timeout=60, materialize=True,
+                                      fields=('id', 'username'), index_by=('username',))
+        identifier = get_random_string()
+        rows = model_cache.get(identifier)
+        self.assertIsInstance(rows, CachedRows)
+        with self.assertNumQueries(0):
+            rows = model_cache.get(identifier)
+            self.assertEqual(rows.get_cached(username=user.username)['id'], user.pk)
+
+        new_user = self._create_user()
+        rows = model_cache.get(identifier)
+        self.assertEqual(rows.get_cached(username=new_user.username)['id'], new_user.pk)
+
+
+class LocalCacheTests(CacheTestMixin, TestCase):
+
+    def tearDown(self):
+        cache.delete(LOCAL_GENERATION_KEY % self.key)
+        get_local_cache().delete(self.key)
+        super().tearDown()
+
+    def test_lru_eviction(self):
+        """
+        超过maxsize时淘汰最久未使用的项
+        """
+        local_cache = LocalCache(cache, maxsize=2)
+        local_cache.set('a', 1)
+        local_cache.set('b', 2)
+        self.assertEqual(local_cache.get('a'), 1)
+        local_cache.set('c', 3)
+        self.assertIs(local_cache.get('b'), _missing)
+        self.assertEqual(local_cache.get('a'), 1)
+        self.assertEqual(local_cache.get('c'), 3)
+        self.assertEqual(len(local_cache), 2)
+
+    def test_timeout(self):
+        """
+        本地副本超时后失效
+        """
+        local_cache = LocalCache(cache)
+        local_cache.set('a', 1, timeout=0.05)
+        self.assertEqual(local_cache.get('a'), 1)
+        time.sleep(0.1)
+        self.assertIs(local_cache.get('a'), _missing)
+
+    def test_invalidate_per_key(self):
+        """
+        一个进程更新某个键后，其他进程中该键的本地副本失效，其他键不受影响
+        """
+        other_key = self.key + '_other'
+        self.addCleanup(cache.delete, LOCAL_GENERATION_KEY % other_key)
+        # two processes
+        local_cache = LocalCache(cache, check_interval=0)
+        other_process = LocalCache(cache, check_interval=0)
+        for key in (self.key, other_key):
+            local_cache.set(key, 'old', generation=local_cache.get_generation(key))
+        other_process.invalidate(self.key)
+        self.assertIs(local_cache.get(self.key), _missing)
+        self.assertEqual(local_cache.get(other_key), 'old')
+
+    def test_check_interval(self):
+        """
+        check_interval内不检查共享缓存中的版本
+        """
+        local_cache = LocalCache(cache, check_interval=60)
+        local_cache.set(self.key, 'old', generation=local_cache.get_generation(self.key))
+        LocalCache(cache).invalidate(self.key)
+        with mock.patch.object(cache, 'get') as get:
+            self.assertEqual(local_cache.get(self.key), 'old')
+        get.assert_not_called()
+
+    def test_two_tier_timeout(self):
+        """
+        本地副本的超时时间不超过缓存的timeout，timeout为0时不保存本地副本
+        """
+        GenericBasedCache(self.key, timeout=1, two_tier=True).set('value')
+        entry = get_local_cache()._data[self.key]
+        self.assertLessEqual(entry[1] - time.monotonic(), 1)
+
+        GenericBasedCache(self.key, timeout=0, two_tier=True).set('value')
+        self.assertNotIn(self.key, get_local_cache()._data)
+
+    def test_two_tier_get(self):
+        """
+        两级缓存：本地未命中时读取共享缓存，其他进程set后本地副本失效
+        """
+        generic_cache = GenericBasedCache(self.key, timeout=60, two_tier=True)
+        generic_cache.set('value')
+        self.assertEqual(generic_cache.get(), 'value')
+        # another process
+        cache.set(self.key, 'changed', 60)
+        LocalCache(cache).invalidate(self.key)
+        with mock.patch.object(get_local_cache(), 'check_interval', 0):
+            self.assertEqual(generic_cache.get(), 'changed')
+
+
+class QuerySetCacheTests(TestMixin, TestCase):
+
+    def test_declared_models_only(self):
+        """
+        只缓存QuerySetCache中声明的模型
+        """
+        names = list(queryset_cache.__dir__())
+        self.assertIn('base_User', names)
+        self.assertNotIn('sessions_Session', names)
+        self.assertIsNone(getattr(queryset_cache, 'sessions_Session', None))
+
+    def test_cached_queryset(self):
+        """
+        回填后读取缓存不再查询数据库，数据变动后自动失效
+        """
+        role = self.role_model.objects.create(name=get_random_string())
+        queryset_cache.refill('base_Group')
+        with self.assertNumQueries(0):
+            self.assertIn(role.pk, [r.pk for r in queryset_cache.base_Group])
+        role.delete()
+        self.assertNotIn(role.pk, [r.pk for r in queryset_cache.base_Group])
+
+
+class ModelBasedCacheBatchTests(TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.model_cache = ModelBasedCache(get_user_model(), timeout=60, disable_warnings=True)
+        self.prefix = get_random_string()
+
+    def test_get_many_loads_missing_only(self):
+        """
+        get_many只为缓存中不存在的identifiers调用loader，并写入缓存
+        """
+        cached, missing = self.prefix + '_cached', self.prefix + '_missing'
+        self.model_cache.set_many({cached: 'cached value'})
+        loaded = list()
+
+        def loader(identifier_list):
+            loaded.extend(identifier_list)
+            return {identifiers: identifiers + ' value' for identifiers in identifier_list}
+
+        result = self.model_cache.get_many([cached, missing], loader=loader)
+        self.assertEqual(result, {cached: 'cached value', missing: missing + ' value'})
+        self.assertEqual(loaded, [missing])
+        self.assertEqual(self.model_cache.get_many([missing]), {missing: missing + ' value'})
+
+    def test_get_many_without_loader(self):
+        """
+        没有loader时，不存在的identifiers不出现在结果中
+        """
+        self.assertEqual(self.model_cache.get_many([self.prefix]), dict())
+
+    def test_tuple_identifiers(self):
+        """
+        多个字符串组成的identifiers与get/set的键一致
+        """
+        identifiers = (self.prefix, 'a')
+        self.model_cache.set_many({identifiers: 'value'})
+        self.assertEqual(self.model_cache.get_many([identifiers]), {identifiers: 'value'})
+        self.assertEqual(self.model_cache.get(identifiers), 'value')
+
+    def test_invalidated_by_changes(self):
+        """
+        模型数据变动后，批量写入的缓存失效
+        """
+        self.model_cache.set_many({self.prefix: 'value'})
+        self._create_user()
+        self.assertEqual(self.model_cache.get_many([self.prefix]), dict())
+
+
+class CacheMetricsTests(TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sink = cache_metrics.MemorySink()
+        patcher = mock.patch.object(cache_metrics, '_sink', self.sink)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hits_and_misses(self):
+        """
+        记录缓存的命中、未命中和回填耗时
+        """
+        model_cache = ModelBasedCache(get_user_model(), timeout=60)
+        identifier = get_random_string()
+        for _ in range(3):
+            model_cache.get(identifier)
+        item = self.sink.summary()[model_cache.name]
+        self.assertEqual((item['hits'], item['misses']), (2, 1))
+        self.assertAlmostEqual(item['hit_rate'], 2 / 3)
+        self.assertIsNotNone(item['avg_refill_time'])
+
+    def test_named_caches(self):
+        """
+        同一model的缓存使用不同的name时分别记录指标
+        """
+        default_cache = ModelBasedCache(get_user_model(), timeout=60)
+        named_cache = ModelBasedCache(get_user_model(), timeout=60, name='test_cache_users')
+        identifier = get_random_string()
+        for _ in range(2):
+            default_cache.get(identifier)
+        named_cache.get(identifier)
+        summary = self.sink.summary()
+        self.assertEqual((summary[default_cache.name]['hits'], summary[default_cache.name]['misses']), (1, 1))
+        self.assertEqual((summary['test_cache_users']['hits'], summary['test_cache_users']['misses']), (0, 1))
+        self.assertNotEqual(named_cache._get_key(identifier), default_cache._get_key(identifier))
+
+    def test_size(self):
+        """
+        编码后的值直接计算大小，其他值按采样率计算
+        """
+        cache_metrics.record('encoded', False, 0.1, b'12345')
+        with self.settings(CACHE_METRICS_SIZE_SAMPLE_RATE=0):
+            cache_metrics.record('raw', False, 0.1, 'x' * 100)
+        with self.settings(CACHE_METRICS_SIZE_SAMPLE_RATE=1):
+            cache_metrics.record('sampled', False, 0.1, 'x' * 100)
+        summary = self.sink.summary()
+        self.assertEqual(summary['encoded']['size'], 5)
+        self.assertEqual(summary['raw']['size'], 0)
+        self.assertGreater(summary['sampled']['size'], 100)
+
+    def test_shared_sink(self):
+        """
+        SharedCacheSink汇总所有进程的指标，并发注册的前缀不会丢失
+        """
+        prefix = get_random_string()
+        # two processes
+        sinks = [cache_metrics.SharedCacheSink(flush_interval=0), cache_metrics.SharedCacheSink(flush_interval=0)]
+        self.addCleanup(sinks[0].reset)
+        sinks[0].record(cache_metrics.CacheEvent(prefix + '_a', True, 0, None, 0))
+        sinks[1].record(cache_metrics.CacheEvent(prefix + '_b', False, 0.5, 10, 0))
+        sinks[1].record(cache_metrics.CacheEvent(prefix + '_a', True, 0, None, 0))
+        summary = sinks[0].summary()
+        self.assertEqual(summary[prefix + '_a']['hits'], 2)
+        self.assertEqual(summary[prefix + '_b']['misses'], 1)
+        self.assertEqual(summary[prefix + '_b']['size'], 10)
+
+        sinks[0].reset()
+        self.assertNotIn(prefix + '_a', sinks[1].summary())
+
+
+class CacheCodecTests(TestMixin, TestCase):
+
+    def test_pickle_codec(self):
+        """
+        PickleCodec编码后可还原
+        """
+        value = {'a': [1, 2, 3], 'b': None}
+        data = PickleCodec().encode(value)
+        self.assertIsInstance(data, bytes)
+        self.assertEqual(PickleCodec().decode(data), value)
+
+    def test_zlib_codec(self):
+        """
+        ZlibCodec只压缩不小于threshold的值
+        """
+        codec = ZlibCodec(threshold=100)
+        small, large = 'x', 'x' * 1000
+        self.assertEqual(codec.decode(codec.encode(small)), small)
+        self.assertEqual(codec.decode(codec.encode(large)), large)
+        self.assertLess(len(codec.encode(large)), len(PickleCodec().encode(large)))
+
+    def test_rows_codec(self):
+        """
+        RowsCodec编码CachedRows，解码后重建索引，不接受QuerySet
+        """
+        codec = RowsCodec()
+        rows = CachedRows(('id', 'user_id'), [(1, 10), (2, 20)], index_by=('user_id',))
+        decoded = codec.decode(codec.encode(rows))
+        self.assertEqual(decoded.rows, rows.rows)
+        self.assertEqual(decoded.indexes, rows.indexes)
+        self.assertEqual(decoded.get_cached(user_id=20)['id'], 2)
+
+        self.assertEqual(codec.decode(codec.encode('raw')), 'raw')
+        with self.assertRaises(TypeError):
+            codec.encode(get_user_model().objects.all())
+        # a cache of QuerySets would return QuerySets on misses but CachedRows on hits
+        with self.assertRaises(TypeError):
+            ModelBasedCache(get_user_model(), timeout=60, codec=RowsCodec()).get(get_random_string())
+
+    def test_model_cache_with_codec(self):
+        """
+        使用codec的缓存，回填和命中时的读取结果相同
+        """
+        user = self._create_user()
+        model_cache = ModelBasedCache(get_user_model(), timeout=60, materialize=True,
+                                      codec=ZlibCodec(RowsCodec(), threshold=0))
+        identifier = get_random_string()
+        for _ in range(2):
+            rows = model_cache.get(identifier)
+            self.assertEqual(rows.get_cached(id=user.pk)['username'], user.username)
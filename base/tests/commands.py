@@ -0,0 +1,67 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from common.core import cache_metrics
+from common.core.cache import QuerySetCache, queryset_cache
+from common.test import TestMixin
+
+
+class WarmCacheCommandTests(TestMixin, TestCase):
+
+    def _warm(self):
+        out = StringIO()
+        with mock.patch.object(QuerySetCache, 'refill') as refill:
+            call_command('warm_cache', '--skip-permissions', stdout=out)
+        self.assertIn('0 failed', out.getvalue())
+        return {c.args[0] for c in refill.call_args_list}
+
+    def test_declared_caches_only(self):
+        """
+        只预热QuerySetCache中声明的模型，timeout为0的模型不预热
+        """
+        warmed = self._warm()
+        self.assertIn('base_User', warmed)
+        self.assertNotIn('sessions_Session', warmed)
+        self.assertLessEqual(warmed, set(QuerySetCache._get_declared_attrs()))
+        with mock.patch.dict(queryset_cache._named_mappings, {'base_User': 0}):
+            self.assertNotIn('base_User', self._warm())
+
+
+class CacheStatsCommandTests(TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sink = cache_metrics.MemorySink()
+        patcher = mock.patch.object(cache_metrics, '_sink', self.sink)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cache_stats(self):
+        """
+        输出记录的命中和未命中次数，--reset后清空
+        """
+        for _ in range(3):
+            cache_metrics.record('test_stats_prefix', True)
+        cache_metrics.record('test_stats_prefix', False, 0.01, b'12345')
+        out = StringIO()
+        call_command('cache_stats', stdout=out)
+        rows = [line.split() for line in out.getvalue().splitlines() if 'test_stats_prefix' in line]
+        # hottest and largest
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0][:4], ['test_stats_prefix', '3', '1', '75.0%'])
+
+        call_command('cache_stats', '--reset', stdout=StringIO())
+        out = StringIO()
+        call_command('cache_stats', stdout=out)
+        self.assertNotIn('test_stats_prefix', out.getvalue())
+
+    def test_metrics_disabled(self):
+        """
+        未启用指标时报错
+        """
+        with mock.patch.object(cache_metrics, '_sink', None), self.settings(CACHE_METRICS_SINK=None):
+            with self.assertRaises(CommandError):
+                call_command('cache_stats', stdout=StringIO())
@@ -0,0 +1,237 @@
+import json
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase
+
+from common.core.exceptions import InvalidParameter
+from common.test import TestMixin
+from common.utils.json import normalize
+from common.views import AdvancedListView
+from common.views.general import COUNT_CACHED, COUNT_ESTIMATED, COUNT_EXACT
+
+
+class ListViewTestMixin(TestMixin):
+    """
+    Tests on a list view of users, subclasses override view_attrs to configure the view
+    """
+    view_attrs = {}
+
+    def setUp(self):
+        super().setUp()
+        attrs = {'model': self.user_model, 'ordering': 'id'}
+        attrs.update(self.view_attrs)
+        self.view_class = type('UserList', (AdvancedListView,), attrs)
+
+    def _request(self, **params):
+        request = RequestFactory().get('/', params)
+        request.user = self.user
+        return request
+
+    def _get(self, view_class=None, **params):
+        return (view_class or self.view_class).as_view()(self._request(**params))
+
+
+class FilterSchemaTests(ListViewTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.users = [self._create_user(last_name=str(i % 2)) for i in range(4)]
+        self.user = self.users[0]
+
+    def _get_ids(self, view_class=None, **params):
+        response = self._get(view_class, **params)
+        return [item['id'] for item in json.loads(response.content)['data']['objects']]
+
+    def test_schema_is_compiled_once(self):
+        """
+        过滤参数按视图类编译一次，子类使用自己的过滤字段
+        """
+        schema = self.view_class.get_filter_schema(self.user_model)
+        self.assertIs(self.view_class.get_filter_schema(self.user_model), schema)
+        self.assertEqual(schema['exclude__username__exact'], (True, 'username__exact', schema['username__exact'][2]))
+        self.assertIn('last_name__icontains', schema)
+
+        class UsernameList(self.view_class):
+            filter_fields = ('username',)
+
+        class IndexedList(self.view_class):
+            filter_indexed_only = True
+
+        self.assertEqual({k.split('__')[-2] for k in UsernameList.get_filter_schema(self.user_model)}, {'username'})
+        indexed_schema = IndexedList.get_filter_schema(self.user_model)
+        self.assertIn('username__exact', indexed_schema)
+        self.assertNotIn('last_name__exact', indexed_schema)
+        # the parent schema is untouched
+        self.assertIs(self.view_class.get_filter_schema(self.user_model), schema)
+
+    def test_filter(self):
+        """
+        按请求中的参数过滤和排除
+        """
+        ids = [u.pk for u in self.users]
+        self.assertEqual(self._get_ids(), ids)
+        usernames = json.dumps([u.username for u in self.users[:2]])
+        self.assertEqual(self._get_ids(username__in=usernames), ids[:2])
+        self.assertEqual(self._get_ids(id__gt=ids[1]), ids[2:])
+        self.assertEqual(self._get_ids(id__range='[%d, %d]' % (ids[1], ids[2])), ids[1:3])
+        self.assertEqual(self._get_ids(last_name__exact='0'), ids[::2])
+        self.assertEqual(self._get_ids(exclude__last_name__exact='0'), ids[1::2])
+        # filtering wins if both are present
+        self.assertEqual(self._get_ids(last_name__exact='0', exclude__last_name__exact='0'), ids[::2])
+        # parameters of fields not allowed are ignored
+        self.assertEqual(self._get_ids(type('UsernameList', (self.view_class,), {'filter_fields': ('username',)}),
+                                   last_name__exact='0'), ids)
+
+    def test_invalid_value(self):
+        """
+        参数值非法时返回InvalidParameter
+        """
+        for params in ({'id__exact': 'abc'}, {'id__in': '[1, "a"]'}, {'id__range': '1'},
+                       {'id__range': '[1, 2, 3]'}, {'last_name__isnull': 'maybe'}):
+            with self.subTest(**params), self.assertRaises(InvalidParameter):
+                self._get_ids(**params)
+
+
+class CountStrategyTests(ListViewTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = self._create_user()
+        self.cache_keys = set()
+
+    def tearDown(self):
+        cache.delete_many(self.cache_keys)
+        super().tearDown()
+
+    def _get_data(self, count_strategy, **params):
+        request = self._request(**params)
+        view = self.view_class()
+        view.count_strategy = count_strategy
+        view.setup(request)
+        response = view.dispatch(request)
+        if count_strategy == COUNT_CACHED:
+            self.cache_keys.add(view._get_count_cache_key())
+        data = json.loads(response.content)['data']
+        self.assertEqual(data['total_length'], view.total_length)
+        self.assertEqual(data['exact_count'], view.exact_count)
+        return data
+
+    def test_exact(self):
+        """
+        精确计数
+        """
+        self._create_user()
+        data = self._get_data(COUNT_EXACT, pageSize=1)
+        self.assertEqual(data['total_length'], 2)
+        self.assertTrue(data['exact_count'])
+
+    def test_cached(self):
+        """
+        缓存的计数按过滤参数区分，与分页和排序参数无关
+        """
+        data = self._get_data(COUNT_CACHED, pageSize=1)
+        self.assertEqual(data['total_length'], 1)
+        self.assertTrue(data['exact_count'])
+        self._create_user(last_name='cached')
+        data = self._get_data(COUNT_CACHED, pageSize=1, page=1, orderBy='-id')
+        self.assertEqual(data['total_length'], 1)
+        self.assertFalse(data['exact_count'])
+        data = self._get_data(COUNT_CACHED, pageSize=1, last_name__exact='cached')
+        self.assertEqual(data['total_length'], 1)
+        self.assertTrue(data['exact_count'])
+        data = self._get_data(COUNT_CACHED, pageSize=1, exclude__last_name__exact='cached')
+        self.assertEqual(data['total_length'], 1)
+
+    def test_estimated(self):
+        """
+        估算计数，不支持估算时为精确计数
+        """
+        with mock.patch.object(self.view_class, '_estimate_count', return_value=42):
+            data = self._get_data(COUNT_ESTIMATED, pageSize=1)
+        self.assertEqual(data['total_length'], 42)
+        self.assertFalse(data['exact_count'])
+        with mock.patch.object(self.view_class, '_estimate_count', return_value=None):
+            data = self._get_data(COUNT_ESTIMATED, pageSize=1)
+        self.assertEqual(data['total_length'], 1)
+        self.assertTrue(data['exact_count'])
+        data = self._get_data(COUNT_ESTIMATED, pageSize=1)
+        self.assertIsInstance(data['total_length'], int)
+        self.assertEqual(data['exact_count'], connection.vendor != 'mysql')
+
+    def test_pages_beyond_inexact_count(self):
+        """
+        估算或缓存的计数小于实际数量时，之后的页仍可访问
+        """
+        users = [self.user] + [self._create_user() for _ in range(2)]
+        with mock.patch.object(self.view_class, '_estimate_count', return_value=1):
+            data = self._get_data(COUNT_ESTIMATED, pageSize=1, page=3)
+            self.assertEqual([item['id'] for item in data['objects']], [users[2].pk])
+            self.assertEqual(data['total_length'], 1)
+            self.assertFalse(data['exact_count'])
+            # beyond the data
+            data = self._get_data(COUNT_ESTIMATED, pageSize=1, page=4)
+            self.assertEqual(data['objects'], [])
+        # the cached count is outdated, pages are sliced in the database
+        self.view_class.paginate_in_database = True
+        self._get_data(COUNT_CACHED, pageSize=2)
+        users += [self._create_user() for _ in range(2)]
+        data = self._get_data(COUNT_CACHED, pageSize=2, page=3)
+        self.assertEqual([item['id'] for item in data['objects']], [users[4].pk])
+        self.assertEqual(data['total_length'], 3)
+        self.assertFalse(data['exact_count'])
+
+
+class StreamingResponseTests(ListViewTestMixin, TestCase):
+    view_attrs = {'stream_all': True, 'stream_chunk_size': 2}
+
+    def setUp(self):
+        super().setUp()
+        self.users = [self._create_user(last_name=str(i % 2)) for i in range(5)]
+        self.user = self.users[0]
+
+    def _assert_same_as_json_response(self, view_class, **params):
+        response = self._get(view_class, all='true', **params)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        content = json.loads(b''.join(response.streaming_content))
+        expected = self._get(type('UserList', (view_class,), {'stream_all': False}), all='true', **params)
+        self.assertFalse(expected.streaming)
+        self.assertEqual(content, json.loads(expected.content))
+        return content
+
+    def test_stream_all(self):
+        """
+        all=true时以流的形式返回，内容为合法的JSON，与非流式的返回值相同
+        """
+        content = self._assert_same_as_json_response(self.view_class)
+        self.assertEqual([item['id'] for item in content['data']], [u.pk for u in self.users])
+        # chunks of 2 rows, the last one is not full
+        content = self._assert_same_as_json_response(self.view_class, last_name__exact='0')
+        self.assertEqual(len(content['data']), 3)
+
+    def test_stream_values(self):
+        """
+        values()同样可用
+        """
+        class UserValuesList(self.view_class):
+            queryset = self.user_model.objects.values('id', 'username', 'date_joined')
+
+        content = self._assert_same_as_json_response(UserValuesList)
+        self.assertEqual(content['data'], normalize(list(UserValuesList.queryset.order_by('id'))))
+
+    def test_stream_empty(self):
+        """
+        没有数据时data为空列表
+        """
+        content = self._assert_same_as_json_response(self.view_class, last_name__exact='none')
+        self.assertEqual(content['data'], [])
+
+    def test_paged_list_is_not_streamed(self):
+        """
+        分页请求不以流的形式返回
+        """
+        response = self._get(pageSize=2)
+        self.assertFalse(response.streaming)
+        self.assertEqual(len(json.loads(response.content)['data']['objects']), 2)
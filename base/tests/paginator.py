@@ -0,0 +1,165 @@
+from bson import ObjectId
+from django.core import signing
+from django.test import TestCase
+from pymongo import DESCENDING
+
+from common.core.exceptions import InvalidParameter
+from common.paginator import CursorPaginator, MongoCursorPaginator
+from common.test import TestMixin
+
+
+class FakeCursor:
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, keys):
+        for key, direction in reversed(keys):
+            self.documents.sort(key=lambda d: d[key], reverse=direction == DESCENDING)
+        return self
+
+    def limit(self, limit):
+        self.documents = self.documents[:limit]
+        return self
+
+    def __iter__(self):
+        return iter(self.documents)
+
+
+class FakeCollection:
+    """
+    A collection in memory, supporting the queries made by MongoCursorPaginator
+    """
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    @classmethod
+    def _match(cls, document, conditions):
+        for key, condition in conditions.items():
+            if key == '$and':
+                if not all(cls._match(document, c) for c in condition):
+                    return False
+            elif key == '$or':
+                if not any(cls._match(document, c) for c in condition):
+                    return False
+            elif isinstance(condition, dict):
+                for op, value in condition.items():
+                    if op == '$lt' and not document[key] < value:
+                        return False
+                    elif op == '$gt' and not document[key] > value:
+                        return False
+            elif document[key] != condition:
+                return False
+        return True
+
+    def find(self, conditions):
+        return FakeCursor([d for d in self.documents if self._match(d, conditions)])
+
+    def count_documents(self, conditions):
+        return len(self.find(conditions).documents)
+
+
+def walk(paginator):
+    """
+    Return pages (lists of items) from the first to the last, and from the last back to the first
+    """
+    forward = list()
+    page = paginator.page()
+    forward.append(list(page))
+    while page.next_cursor:
+        page = paginator.page(page.next_cursor)
+        forward.append(list(page))
+    backward = [list(page)]
+    while page.prev_cursor:
+        page = paginator.page(page.prev_cursor)
+        backward.append(list(page))
+    return forward, backward
+
+
+class CursorPaginatorTests(TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        # two users share each last_name, so that seeking relies on pk
+        self.users = [self._create_user(last_name=str(i // 2)) for i in range(7)]
+
+    def test_ordering_by_pk(self):
+        """
+        按主键向前、向后翻页，每页数据与OFFSET分页相同
+        """
+        queryset = self.user_model.objects.all()
+        forward, backward = walk(CursorPaginator(queryset, 3, '-id'))
+        expected = [[u.pk for u in queryset.order_by('-id')[i:i + 3]] for i in range(0, 7, 3)]
+        self.assertEqual([[u.pk for u in page] for page in forward], expected)
+        self.assertEqual([[u.pk for u in page] for page in backward], expected[::-1])
+
+    def test_ordering_by_field_with_ties(self):
+        """
+        按有重复值的字段翻页时不重复、不遗漏，values()同样可用
+        """
+        queryset = self.user_model.objects.values('id', 'last_name')
+        forward, backward = walk(CursorPaginator(queryset, 2, 'last_name'))
+        expected = list(queryset.order_by('last_name', 'id'))
+        self.assertEqual([item for page in forward for item in page], expected)
+        self.assertEqual([item for page in backward[::-1] for item in page], expected)
+
+    def test_first_page(self):
+        """
+        第一页没有上一页，最后一页没有下一页，count为总数
+        """
+        paginator = CursorPaginator(self.user_model.objects.all(), 10)
+        page = paginator.page()
+        self.assertEqual(len(page), 7)
+        self.assertIsNone(page.next_cursor)
+        self.assertIsNone(page.prev_cursor)
+        self.assertEqual(paginator.count, 7)
+
+    def test_tampered_cursor(self):
+        """
+        被篡改或其他分页器的游标无效
+        """
+        paginator = CursorPaginator(self.user_model.objects.all(), 3)
+        cursor = paginator.page().next_cursor
+        with self.assertRaises(InvalidParameter):
+            paginator.page(cursor[:-1] + ('A' if cursor[-1] != 'A' else 'B'))
+        with self.assertRaises(InvalidParameter):
+            paginator.page('not a cursor')
+        with self.assertRaises(InvalidParameter):
+            paginator.page(signing.dumps([False, [['v', 1], ['v', 1]]], salt=MongoCursorPaginator.salt))
+
+
+class MongoCursorPaginatorTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.documents = [{'_id': ObjectId(), 'score': i // 2, 'kind': 'a' if i % 3 else 'b'} for i in range(9)]
+        self.collection = FakeCollection(list(self.documents))
+
+    def test_ordering_by_field_with_ties(self):
+        """
+        按有重复值的字段向前、向后翻页
+        """
+        forward, backward = walk(MongoCursorPaginator(self.collection, 2, '-score'))
+        expected = sorted(self.documents, key=lambda d: (d['score'], d['_id']), reverse=True)
+        self.assertEqual([d for page in forward for d in page], expected)
+        self.assertEqual([d for page in backward[::-1] for d in page], expected)
+
+    def test_filter(self):
+        """
+        翻页和计数都在filter范围内
+        """
+        paginator = MongoCursorPaginator(self.collection, 2, '_id', filter={'kind': 'a'})
+        forward, _ = walk(paginator)
+        expected = sorted([d for d in self.documents if d['kind'] == 'a'], key=lambda d: d['_id'])
+        self.assertEqual([d for page in forward for d in page], expected)
+        self.assertEqual(paginator.count, len(expected))
+
+    def test_tampered_cursor(self):
+        """
+        被篡改的游标无效
+        """
+        paginator = MongoCursorPaginator(self.collection, 2)
+        cursor = paginator.page().next_cursor
+        with self.assertRaises(InvalidParameter):
+            paginator.page(cursor + 'x')
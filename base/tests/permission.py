@@ -0,0 +1,61 @@
+import json
+
+from django.test import TestCase
+from django.urls import reverse
+from django.utils.translation import gettext
+
+from base.models import Permission
+from common.test import TestMixin
+
+
+class PermissionViewTests(TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login_as_superuser()
+
+    @staticmethod
+    def _format(perms):
+        # the output before the values() rewrite, content_type flattened into each item
+        return sorted(({
+            'id': perm.pk,
+            'name': perm.name,
+            'codename': perm.codename,
+            'app_label': perm.content_type.app_label,
+            'app_label_local': gettext(perm.content_type.app_label),
+            'model': perm.content_type.model,
+            'model_local': gettext(perm.content_type.model)
+        } for perm in perms), key=lambda item: item['id'])
+
+    def _get(self, **params):
+        params.setdefault('all', 'true')
+        response = self.client.get(reverse('base:permission_list'), data=params)
+        content = json.loads(response.content)
+        self.assertEqual(content['code'], 200)
+        return sorted(content['data'], key=lambda item: item['id'])
+
+    def test_permission_list(self):
+        """
+        所有权限，超级用户拥有所有权限
+        """
+        expected = self._format(Permission.objects.select_related('content_type'))
+        self.assertEqual(self._get(), expected)
+        superuser = self._create_user(is_active=True, is_superuser=True)
+        self.assertEqual(self._get(user_id=superuser.pk), expected)
+
+    def test_user_permission_list(self):
+        """
+        用户的权限为其所有角色权限的并集，多个角色拥有的权限不重复
+        """
+        perms = list(Permission.objects.select_related('content_type').filter(
+            content_type__app_label='base', codename__in=('view_role', 'create_role', 'update_role')))
+        user = self._create_user(is_active=True)
+        role_a = self.role_model.objects.create(name=self.role)
+        role_b = self.role_model.objects.create(name=self.role + '_b')
+        role_a.permissions.add(perms[0], perms[1])
+        role_b.permissions.add(perms[1], perms[2])
+        user.groups.add(role_a, role_b)
+        self.assertEqual(self._get(user_id=user.pk), self._format(perms))
+        # filters of the list apply to permissions of the user too
+        self.assertEqual(self._get(user_id=user.pk, codename__exact=perms[1].codename), self._format(perms[1:2]))
+        self.assertEqual(self._get(user_id=self._create_user(is_active=True).pk), [])
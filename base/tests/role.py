@@ -1,14 +1,100 @@
 import json
+from unittest import mock
 
-from django.test import TestCase
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
 from django.urls import reverse
+from django.utils import timezone
 
 from base.models import Group as Role, Permission
+from base.views.role import ROLE_SUMMARY, load_role_summary, role_summary_cache
+from common.backends.user import PermissionIndex, UserAuthBackend, load_permissions, permission_cache
 from common.test import TestMixin
 
 
 class RoleModelTests(TestMixin, TestCase):
-    ...
+
+    def test_role_perms_change_takes_effect(self):
+        """
+        角色权限变动后，用户权限（缓存）立即生效
+        """
+        user = self._create_user(is_active=True)
+        role = self._create_role()
+        user.groups.add(role)
+        # admin, contenttypes and sessions permissions are excluded by the backend
+        perm = Permission.objects.select_related('content_type').get(
+            content_type__app_label='base', codename='view_role')
+        perm_str = '%s.%s' % (perm.content_type.app_label, perm.codename)
+        self.assertFalse(self._get_user(pk=user.pk).has_perm(perm_str))
+
+        role.permissions.add(perm)
+        self.assertTrue(self._get_user(pk=user.pk).has_perm(perm_str))
+
+        role.permissions.remove(perm)
+        self.assertFalse(self._get_user(pk=user.pk).has_perm(perm_str))
+
+
+class PermissionIndexTests(TestMixin, TestCase):
+
+    def test_permission_index(self):
+        """
+        权限字符串与位集互相转换，按应用判断权限
+        """
+        index = PermissionIndex([(1, 'base', 'view_role'), (2, 'base', 'create_role'), (5, 'other', 'view_x')])
+        bitset = index.encode(['base.view_role', 'other.view_x', 'unknown.perm'])
+        self.assertEqual(bitset, 1 << 1 | 1 << 5)
+        self.assertEqual(index.decode(bitset), {'base.view_role', 'other.view_x'})
+        self.assertTrue(index.has_perm(bitset, 'base.view_role'))
+        self.assertFalse(index.has_perm(bitset, 'base.create_role'))
+        self.assertFalse(index.has_perm(bitset, 'unknown.perm'))
+        self.assertTrue(index.has_module_perms(bitset, 'other'))
+        self.assertFalse(index.has_module_perms(1 << 5, 'base'))
+        self.assertEqual(index.decode(index.all_mask), {'base.view_role', 'base.create_role', 'other.view_x'})
+        # bits of deleted permissions are ignored
+        self.assertEqual(index.decode(1 << 3 | 1 << 1), {'base.view_role'})
+
+    def test_backend_permissions(self):
+        """
+        后端返回的权限与角色权限一致，超级用户拥有所有权限
+        """
+        user = self._create_user(is_active=True)
+        role = self.role_model.objects.create(name=self.role)
+        user.groups.add(role)
+        perms = Permission.objects.filter(content_type__app_label='base', codename__in=('view_role', 'create_role'))
+        role.permissions.add(*perms)
+        backend = UserAuthBackend()
+
+        user = self._get_user(pk=user.pk)
+        self.assertEqual(backend.get_all_permissions(user), {'base.view_role', 'base.create_role'})
+        self.assertTrue(backend.has_module_perms(user, 'base'))
+        self.assertFalse(backend.has_perm(user, 'base.delete_role'))
+
+        superuser = self._create_user(is_active=True, is_superuser=True)
+        self.assertEqual(len(backend.get_all_permissions(superuser)), Permission.objects.count())
+        self.assertTrue(backend.has_perm(superuser, 'base.delete_role'))
+
+
+class RoleTransactionTests(TestMixin, TransactionTestCase):
+
+    def test_role_perms_revoked_in_transaction(self):
+        """
+        事务中移除角色权限，提交前其他请求缓存的旧权限在事务提交后失效
+        """
+        user = self._create_user(is_active=True)
+        role = self.role_model.objects.create(name=self.role)
+        user.groups.add(role)
+        perm = Permission.objects.select_related('content_type').get(
+            content_type__app_label='base', codename='view_role')
+        perm_str = '%s.%s' % (perm.content_type.app_label, perm.codename)
+        role.permissions.add(perm)
+        self.assertTrue(self._get_user(pk=user.pk).has_perm(perm_str))
+
+        stale = load_permissions([user.pk])
+        with transaction.atomic():
+            role.permissions.remove(perm)
+            # a concurrent request reads the committed (old) permissions and caches them
+            permission_cache.set_many({str(user_id): bitset for user_id, bitset in stale.items()})
+        self.assertFalse(self._get_user(pk=user.pk).has_perm(perm_str))
 
 
 class RoleViewBaseTests(TestMixin, TestCase):
@@ -26,6 +112,42 @@ class RoleViewBaseTests(TestMixin, TestCase):
         self.assertEqual(content['data']['total_length'], 1)
         self.assertEqual(content['data']['objects'][0]['name'], role.name)
 
+    def test_role_list_number_of_users(self):
+        """
+        角色列表中的用户数（缓存）在用户加入或移出角色后立即更新
+        """
+        self.login_as_superuser()
+        role = self._create_role()
+        user = self._create_user(is_active=True)
+
+        def number_of_users():
+            response = self.client.get(reverse('base:role_list'))
+            objects = json.loads(response.content)['data']['objects']
+            return {item['id']: item['number_of_users'] for item in objects}[role.pk]
+
+        self.assertEqual(number_of_users(), 0)
+        user.groups.add(role)
+        self.assertEqual(number_of_users(), 1)
+        user.groups.remove(role)
+        self.assertEqual(number_of_users(), 0)
+        user.groups.add(role)
+        self.assertEqual(number_of_users(), 1)
+        user.delete()
+        self.assertEqual(number_of_users(), 0)
+
+    def test_role_summary_cache_ignores_user_saves(self):
+        """
+        用户信息变动（如登录时间）不会使角色用户数的缓存失效
+        """
+        user = self._create_user(is_active=True)
+        user.groups.add(self._create_role())
+        role_summary_cache.get(ROLE_SUMMARY, load_role_summary)
+        user.last_login = timezone.now()
+        user.save()
+        load = mock.Mock(side_effect=load_role_summary)
+        role_summary_cache.get(ROLE_SUMMARY, load)
+        load.assert_not_called()
+
     def test_role_create(self):
         """
         创建子角色
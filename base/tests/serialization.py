@@ -0,0 +1,216 @@
+import datetime
+import decimal
+import enum
+import json
+import unittest
+import uuid
+from unittest import mock
+
+import IPy
+from bson import ObjectId
+from django.contrib.auth.models import Permission
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+from django.utils.translation import gettext_lazy as _
+
+from common.constants import SENSITIVE_FIELDS
+from common.forms import Serializer, get_row_converter, model_to_dict, queryset_to_list, values_to_list
+from common.models.fields import DictField
+from common.test import TestMixin
+from common.utils import json as json_utils
+from common.utils.json import (
+    CJsonEncoder, OrJsonBackend, StdlibJsonBackend, normalize, orjson, register_type)
+
+
+class Level(enum.IntEnum):
+    HIGH = 1
+
+
+class JsonEncoderTests(TestCase):
+
+    @staticmethod
+    def _get_data():
+        return {
+            'decimal': decimal.Decimal('1.10'),
+            'datetime': timezone.now(),
+            'date': datetime.date(2020, 1, 2),
+            'time': datetime.time(1, 2, 3),
+            'uuid': uuid.uuid4(),
+            'lazy': _('Invalid parameter'),
+            'nan': float('nan'),
+            'infinity': [float('inf'), float('-inf')],
+            'nested': [{'float': 1.5, 'none': None, 'text': '中文'}],
+            1: 'int key',
+        }
+
+    def test_stdlib_backend(self):
+        """
+        标准库后端的格式化结果，NaN和Infinity输出为null
+        """
+        data = self._get_data()
+        content = json.loads(StdlibJsonBackend().dumps(data))
+        self.assertEqual(content['decimal'], '1.10')
+        self.assertEqual(content['datetime'], timezone.localtime(data['datetime']).strftime('%Y-%m-%d %H:%M:%S'))
+        self.assertEqual(content['date'], '2020-01-02')
+        self.assertEqual(content['uuid'], str(data['uuid']))
+        self.assertEqual(content['lazy'], str(data['lazy']))
+        self.assertIsNone(content['nan'])
+        self.assertEqual(content['infinity'], [None, None])
+        self.assertEqual(content['1'], 'int key')
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_orjson_backend_is_the_same_as_stdlib(self):
+        """
+        orjson后端与标准库后端的输出相同
+        """
+        data = self._get_data()
+        self.assertEqual(json.loads(OrJsonBackend().dumps(data)), json.loads(StdlibJsonBackend().dumps(data)))
+        # integers beyond 64 bits
+        self.assertEqual(json.loads(OrJsonBackend().dumps({'big': 2 ** 70})), {'big': 2 ** 70})
+
+    def test_json_field_uses_stdlib_encoder(self):
+        """
+        存入数据库的JSON文本与编码后端无关
+        """
+        data = self._get_data()
+        self.assertEqual(DictField().get_prep_value(data), json.dumps(data, cls=CJsonEncoder))
+
+
+class RowConverterTests(TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._create_user(first_name='Invalid parameter', last_login=timezone.now())
+        self._create_user(is_active=True)
+        self.role_model.objects.create(name=self.role)
+
+    @staticmethod
+    def _serialize(queryset, **kwargs):
+        # model_to_dict followed by a JSON round trip, the output before rows were converted
+        return [json.loads(json.dumps(model_to_dict(item, **kwargs), cls=CJsonEncoder)) for item in queryset.all()]
+
+    def test_same_as_model_to_dict(self):
+        """
+        values_list()的行转换结果与model_to_dict的序列化结果相同
+        """
+        for queryset in (self.user_model.objects.all(), self.role_model.objects.all()):
+            with self.subTest(model=queryset.model):
+                expected = self._serialize(queryset, exclude=SENSITIVE_FIELDS)
+                self.assertEqual(values_to_list(queryset), expected)
+                self.assertEqual(queryset_to_list(queryset, exclude=SENSITIVE_FIELDS), expected)
+
+    def test_fields_and_i18n_fields(self):
+        """
+        fields、exclude和i18n_fields的结果与model_to_dict相同
+        """
+        queryset = self.user_model.objects.order_by('id')
+        kwargs = {'fields': ('id', 'username', 'first_name', 'last_login', 'password'), 'i18n_fields': 'first_name'}
+        self.assertEqual(values_to_list(queryset, **kwargs),
+                         self._serialize(queryset, exclude=SENSITIVE_FIELDS, **kwargs))
+        self.assertEqual(values_to_list(queryset, exclude='username'),
+                         self._serialize(queryset, exclude=['username'] + SENSITIVE_FIELDS))
+
+    def test_serializer_uses_rows(self):
+        """
+        Serializer序列化模型的QuerySet时不创建模型实例
+        """
+        queryset = self.user_model.objects.all()
+        with mock.patch('common.forms.model_to_dict') as model_to_dict_mock, self.assertNumQueries(1):
+            data = Serializer(queryset).to_python()
+        model_to_dict_mock.assert_not_called()
+        self.assertEqual(data, self._serialize(queryset, exclude=SENSITIVE_FIELDS))
+
+    def test_evaluated_and_distinct_querysets(self):
+        """
+        已查询的QuerySet不再查询，distinct的QuerySet按整行去重
+        """
+        queryset = self.user_model.objects.all()
+        list(queryset)
+        with self.assertNumQueries(0):
+            data = Serializer(queryset).to_python()
+        self.assertEqual(data, self._serialize(queryset, exclude=SENSITIVE_FIELDS))
+
+        queryset = self.user_model.objects.distinct()
+        data = Serializer(queryset, fields=('is_active',)).to_python()
+        self.assertEqual(len(data), self.user_model.objects.count())
+        self.assertEqual(data, self._serialize(queryset, fields=('is_active',), exclude=SENSITIVE_FIELDS))
+
+    def test_values_queryset(self):
+        """
+        values()的QuerySet原样返回
+        """
+        queryset = self.user_model.objects.values('id', 'username').order_by('id')
+        self.assertEqual(Serializer(queryset).to_python(), list(queryset))
+
+    def test_converter_is_compiled_once(self):
+        """
+        转换器按模型和字段编译一次，需要自然键时不可用
+        """
+        converter = get_row_converter(self.user_model, exclude=['username'])
+        self.assertIs(get_row_converter(self.user_model, exclude=('username',)), converter)
+        self.assertIsNot(get_row_converter(self.user_model), converter)
+        self.assertIsNone(get_row_converter(Permission, use_natural_foreign_keys=True))
+        self.assertIsNone(values_to_list(Permission.objects.all(), use_natural_foreign_keys=True))
+
+
+class NormalizeTests(TestMixin, TestCase):
+
+    @staticmethod
+    def _round_trip(obj):
+        return json.loads(json.dumps(obj, cls=CJsonEncoder))
+
+    def test_same_as_json_round_trip(self):
+        """
+        normalize与CJsonEncoder编码再解码的结果相同
+        """
+        user = self._create_user()
+        data = {
+            'decimal': decimal.Decimal('1.10'),
+            'datetime': timezone.now(),
+            'date': datetime.date(2020, 1, 2),
+            'time': datetime.time(1, 2, 3),
+            'uuid': uuid.uuid4(),
+            'object_id': ObjectId(),
+            'lazy': [_('Invalid parameter')],
+            'safe': mark_safe('<b>'),
+            'ip': IPy.IP('192.168.1.1'),
+            'ip_set': IPy.IPSet([IPy.IP('10.0.0.0/8')]),
+            'enum': Level.HIGH,
+            'tuple': (1, 1.5, True, None, '中文'),
+            'user': user,
+            'keys': {2: 'int', 1.5: 'float', True: 'bool', None: 'none', float('inf'): 'infinity'},
+            'nested': [{'list': [[], {}], 'empty': ''}],
+        }
+        self.assertEqual(normalize(data), self._round_trip(data))
+        self.assertEqual(type(normalize(Level.HIGH)), int)
+        self.assertEqual(type(normalize(data['safe'])), str)
+
+    def test_registered_type(self):
+        """
+        注册的类型及其子类同样适用
+        """
+        class Point:
+            def __init__(self, x, y):
+                self.x, self.y = x, y
+
+        class Point3D(Point):
+            pass
+
+        register_type(Point, lambda p: {'x': p.x, 'y': p.y})
+        self.addCleanup(json_utils._resolved_handlers.clear)
+        self.addCleanup(json_utils._type_handlers.pop, Point)
+        data = [Point(1, 2), {'point': Point3D(decimal.Decimal('1.5'), None)}]
+        self.assertEqual(normalize(data), self._round_trip(data))
+        self.assertEqual(normalize(data)[0], {'x': 1, 'y': 2})
+
+    def test_unknown_type(self):
+        """
+        不支持的类型抛出TypeError
+        """
+        for obj in (object(), {'set': {1}}, {(1, 2): 'tuple key'}):
+            with self.subTest(obj=obj):
+                with self.assertRaises(TypeError):
+                    self._round_trip(obj)
+                with self.assertRaises(TypeError):
+                    normalize(obj)
@@ -1,10 +1,17 @@
 import json
+from unittest import mock
 
 from django.contrib.auth.hashers import make_password
 from django.db.utils import IntegrityError
 from django.test import TestCase
 from django.urls import reverse
+from django.utils.crypto import get_random_string
+from redis import RedisError
 
+from common.core import presence
+from common.core.cache import queryset_cache
+from common.core.exceptions import InvalidParameter
+from common.forms import Serializer
 from common.test import TestMixin
 
 
@@ -47,6 +54,30 @@ class UserModelTests(TestMixin, TestCase):
                 password=password,
             )
 
+    def test_user_cache_is_invalidated(self):
+        """
+        用户变动后，缓存自动失效
+        """
+        user = self._create_user()
+        self.assertIn(user.pk, [u.pk for u in queryset_cache.base_User])
+        user.display_name = 'new display name'
+        user.save()
+        cached_user = [u for u in queryset_cache.base_User if u.pk == user.pk][0]
+        self.assertEqual(cached_user.display_name, 'new display name')
+
+    def test_user_serializer_queries(self):
+        """
+        序列化用户及其角色的查询数与用户数无关
+        """
+        role = self._create_role()
+        for _ in range(5):
+            self._create_user().groups.add(role)
+        users = self.user_model.objects.all()
+        with self.assertNumQueries(2):
+            data = Serializer(users, related_sets=('groups',)).to_python()
+        self.assertEqual(len(data), 5)
+        self.assertEqual(data[0]['groups'][0]['id'], role.pk)
+
 
 class UserViewTests(TestMixin, TestCase):
 
@@ -196,3 +227,96 @@ class UserViewTests(TestMixin, TestCase):
         self.assertTrue(content['result'])  # 接口是否成功
         self.assertEqual(content['data']['total_length'], 3)
         self.assertEqual(len(content['data']['objects']), 3)
+
+    def test_user_list_query_count(self):
+        """
+        DEBUG模式下用户列表返回查询数，且不随用户数增加
+        """
+        self.login_as_superuser()
+        self._create_user()
+        with self.settings(DEBUG=True):
+            response = self.client.get(reverse('base:user_list'))
+            query_count = int(response['X-Query-Count'])
+            for _ in range(5):
+                self._create_user()
+            response = self.client.get(reverse('base:user_list'))
+        self.assertEqual(int(response['X-Query-Count']), query_count)
+
+
+class UserPresenceTests(TestMixin, TestCase):
+
+    def setUp(self):
+        # a key of this test only, the shared presence_last_seen is not touched
+        self.tracker = presence.PresenceTracker(key='test_presence_%s' % get_random_string())
+        patcher = mock.patch.object(presence, 'tracker', self.tracker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        presence._touched.clear()
+
+    def tearDown(self):
+        self.tracker.client.delete(self.tracker.key)
+        presence._touched.clear()
+
+    def test_user_list_online_status(self):
+        """
+        用户列表中的在线状态
+        """
+        self.login_as_superuser()
+        online_user = self._create_user(is_active=True)
+        offline_user = self._create_user(is_active=True)
+        presence.touch(online_user.pk)
+
+        response = self.client.get(reverse('base:user_list'))
+        objects = json.loads(response.content)['data']['objects']
+        status = {item['id']: item['is_online'] for item in objects}
+        self.assertTrue(status[online_user.pk])
+        self.assertFalse(status[offline_user.pk])
+
+    def test_online_user_list(self):
+        """
+        在线用户列表，pageSize必须为正数
+        """
+        self.login_as_superuser()
+        online_user = self._create_user(is_active=True)
+        self._create_user(is_active=True)
+        presence.touch(online_user.pk)
+
+        response = self.client.get(reverse('base:online_user_list'))
+        content = json.loads(response.content)
+        self.assertIn(online_user.pk, [item['id'] for item in content['data']['objects']])
+
+        for page_size in (0, -1):
+            response = self.client.get(reverse('base:online_user_list'), data={'pageSize': page_size})
+            content = json.loads(response.content)
+            self.assertFalse(content['result'])
+            self.assertEqual(content['code'], InvalidParameter.code)
+
+    def test_request_when_redis_is_down(self):
+        """
+        redis不可用时，记录用户活动失败不影响请求
+        """
+        self.login_as_superuser()
+        with mock.patch.object(self.tracker, 'heartbeat', side_effect=RedisError('down')) as heartbeat:
+            response = self.client.get(reverse('base:user_list'))
+        self.assertTrue(heartbeat.called)
+        self.assertEqual(json.loads(response.content)['code'], 200)
+
+    def test_user_list_when_redis_is_down(self):
+        """
+        redis不可用时，用户列表正常返回，在线状态为False
+        """
+        self.login_as_superuser()
+        user = self._create_user(is_active=True)
+        client = mock.Mock(**{
+            'zadd.side_effect': RedisError('down'),
+            'pipeline.return_value.execute.side_effect': RedisError('down'),
+        })
+        with mock.patch.object(self.tracker, '_client', client):
+            response = self.client.get(reverse('base:user_list'))
+            self.assertEqual(presence.get_last_activity([user.pk]), {user.pk: None})
+            self.assertFalse(presence.is_online(user.pk))
+        self.assertTrue(client.pipeline.return_value.execute.called)
+        content = json.loads(response.content)
+        self.assertEqual(content['code'], 200)
+        status = {item['id']: item['is_online'] for item in content['data']['objects']}
+        self.assertFalse(status[user.pk])
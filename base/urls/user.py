@@ -4,6 +4,7 @@ from base.views import user
 urlpatterns = [
     # base
     path('user/list/', user.UserList.as_view(), name='user_list'),
+    path('user/online/list/', user.OnlineUserList.as_view(), name='online_user_list'),
     path('user/<int:user_id>/detail/', user.UserDetail.as_view(), name='user_detail'),
     path('user/who-am-i/', user.WhoAmI.as_view()),
     path('user/create/', user.UserCreate.as_view(), name='user_create'),
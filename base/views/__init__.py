@@ -3,7 +3,7 @@ from django.views.generic.base import View as _View
 
 from base.forms import *
 from base.models import SystemSettings
-from common.core.cache import queryset_cache
+from common.core.cache import CachedRows, queryset_cache
 from common.mixin import ResponseMixin, LoginRequiredMixin, PermissionRequiredMixin
 from common.views import UpdateView, AdvancedListView, View
 
@@ -70,4 +70,6 @@ class DatabaseCache(LoginRequiredMixin, View):
             return self.render_to_json_response(
                 result=False, messages="No such app-model '%s'." % app_model
             )
+        if isinstance(queryset, CachedRows):
+            queryset = queryset.values()
         return self.render_to_json_response(data=queryset)
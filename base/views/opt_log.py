@@ -1,6 +1,7 @@
 from base.models import OperationLogEntry
 from common.mixin import LoginRequiredMixin, PermissionRequiredMixin
 from common.views import AdvancedListView
+from common.views.general import COUNT_CACHED
 
 
 class OptLogList(LoginRequiredMixin, PermissionRequiredMixin, AdvancedListView):
@@ -9,3 +10,8 @@ class OptLogList(LoginRequiredMixin, PermissionRequiredMixin, AdvancedListView):
     """
     model = OperationLogEntry
     permission_required = 'base.view_operation_log'
+    paginate_in_database = True
+    # the log table is large and grows all the time
+    count_strategy = COUNT_CACHED
+    # all=true exports the whole log
+    stream_all = True
@@ -1,17 +1,35 @@
 from gettext import gettext
 
 from django.apps import apps
+from django.db.models import Count
+from django.utils import timezone
 from django.views.generic.detail import SingleObjectMixin
 
 from base.constants import BUILT_IN_USER_IDS, USER_SYS_ID, SUB_SYS_ROLE_EXCLUDING_PERMS, GET_APP_LABEL_NAME
 from base.forms.role import *
 from base.management.commands.init_roles import ECLOUD_APP_LIST
 from base.models.role import Group as Role
+from common.core.cache import INVALIDATED_TIMEOUT, ModelBasedCache
 from common.core.exceptions import OperationNotAllowed
-from common.forms import model_to_dict
 from common.mixin import LoginRequiredMixin, PermissionRequiredMixin
 from common.views import CreateView, AdvancedListView, UpdateView, DeleteView
 
+User = apps.get_model('base.User')
+
+# {role_id: number_of_users} of all roles, invalidated when users join or leave roles
+# (m2m_changed of User.groups), see common.core.cache. Deleting a user deletes its rows of
+# User.groups.through with post_delete sent (the intermediate model has receivers, so it is
+# not fast deleted), saving a user (e.g. last_login on every login) changes nothing here.
+ROLE_SUMMARY = 'summary'
+role_summary_cache = ModelBasedCache(
+    Role, timeout=INVALIDATED_TIMEOUT, disable_warnings=True, depends_on=(User.groups.through,),
+    name='base_role_summary')
+
+
+def load_role_summary() -> dict:
+    return dict(Role.objects.annotate(
+        number_of_users=Count('user')).values_list('id', 'number_of_users').order_by())
+
 
 class RoleList(LoginRequiredMixin, PermissionRequiredMixin, AdvancedListView):
     """
@@ -20,13 +38,16 @@ class RoleList(LoginRequiredMixin, PermissionRequiredMixin, AdvancedListView):
     model = Role
     permission_required = 'auth.list_role'
     many_to_many_fields = ('user_set',)
+    paginate_in_database = True
 
     def handle_queryset(self, queryset, **kwargs):
+        summary = role_summary_cache.get(ROLE_SUMMARY, load_role_summary)
         roles = list()
-        for role in queryset:
-            role_dict = model_to_dict(role)
-            role_dict.update({'number_of_users': role.user_set.count()})
-            roles.append(role_dict)
+        for role in queryset.values('id', 'name', 'description', 'created_at'):
+            # same format as model_to_dict
+            role['created_at'] = timezone.localtime(role['created_at']).strftime('%Y-%m-%d %H:%M:%S')
+            role['number_of_users'] = summary.get(role['id'], 0)
+            roles.append(role)
         return roles
 
 
@@ -1,4 +1,7 @@
+import datetime
+
 from django.contrib.auth import login, views as auth_views, update_session_auth_hash, logout
+from django.db.models import F
 from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_protect
@@ -8,15 +11,17 @@ from base.exceptions import NeedChangePassword
 from base.forms.user import (
     UserLoginForm, UserCreatForm, UserUpdateForm, UserRoleUpdateForm, SetPasswordForm,
     ChangePasswordForm, AddressControlForm, LoginPeriodUpdateForm, LoginLimitEditForm)
-from base.helpers.user import idle_time_is_out
 from base.managers import OptLogManager
-from base.models import User, AddressControl, LoginPeriod, Resource
+from base.models import User, AddressControl, LoginPeriod, Resource, Group
 from base.models.user import LoginTerminal
 from base.signals import password_update_end
 from base.constants import BUILT_IN_USER_NAMES
-from common.core.exceptions import OperationNotAllowed
+from common.core import presence
+from common.core.cache import invalidate
+from common.core.exceptions import InvalidParameter, OperationNotAllowed
 from common.forms import Serializer, model_to_dict, queryset_to_list
 from common.mixin import ResponseMixin, FormValidationMixin, PermissionRequiredMixin, LoginRequiredMixin, BaseViewMixin
+from common.utils.text import str2int
 from common.views.general import (
     AdvancedListView, DeleteView, UpdateView, FormView, CreateView, DetailView, View)
 
@@ -150,24 +155,55 @@ class UserList(LoginRequiredMixin, PermissionRequiredMixin, AdvancedListView):
     permission_required = 'base.list_user'
     ordering = ('-id',)
     related_sets = ('groups',)
+    paginate_in_database = True
 
     def get_queryset(self):
         return super().get_queryset().exclude(is_deleted=True)
 
     def handle_queryset(self, queryset, **kwargs):
         # superuser仅用于开发，对用户不可见
-        users = Serializer(
-            queryset, exclude='is_deleted',
-            related_sets=self.related_sets,
-        ).to_python()
+        users = Serializer(queryset, exclude='is_deleted').to_python()
+        user_ids = [user['id'] for user in users]
+        online = presence.get_online_status(user_ids)
+        # 目前只能有一个角色，一次查询获取所有用户的第一个角色
+        first_groups = dict()
+        for group in Group.objects.filter(user__in=user_ids).annotate(member_id=F('user')).order_by('id'):
+            first_groups.setdefault(group.member_id, group)
+        serialized_groups = dict()
         for user in users:
-            is_online = not idle_time_is_out(user)
-            user.update(is_online=is_online)
-            # 目前只能有一个角色
-            user['groups'] = user['groups'][0] if user['groups'] else None
+            user['is_online'] = online[user['id']]
+            group = first_groups.get(user['id'])
+            if group is not None and group.pk not in serialized_groups:
+                serialized_groups[group.pk] = model_to_dict(group)
+            user['groups'] = serialized_groups[group.pk] if group is not None else None
         return users
 
 
+class OnlineUserList(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """
+    在线用户列表，按最后活动时间倒序
+    URL参数：page, pageSize
+    """
+    http_method_names = ['get']
+    permission_required = 'base.list_user'
+
+    def get(self, request, *args, **kwargs):
+        page = max(str2int(request.GET.get('page'), default=1), 1)
+        page_size = str2int(request.GET.get('pageSize'), default=10)
+        if page_size <= 0:
+            raise InvalidParameter(param='pageSize')
+        last_seen = presence.get_online_users(offset=(page - 1) * page_size, limit=page_size)
+        users = {user['id']: user for user in User.objects.filter(
+            pk__in=[user_id for user_id, _ in last_seen]
+        ).values('id', 'username', 'display_name')}
+        objects = list()
+        for user_id, timestamp in last_seen:
+            if user_id in users:
+                objects.append(dict(users[user_id], last_seen=datetime.datetime.fromtimestamp(timestamp, tz=timezone.utc)))
+        return self.render_to_json_response(
+            data={'objects': objects, 'total_length': presence.count_online_users()})
+
+
 class UserDetail(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
     """
     用户详情
@@ -422,6 +458,8 @@ class LoginLimitEdit(LoginRequiredMixin, PermissionRequiredMixin, FormView):
         # 物理地址
         LoginTerminal.objects.update_or_create(login_terminal, user=user)
         User.objects.update(is_enabled_address_control=address_control_list.get('is_enabled'))
+        # update() sends no signals
+        invalidate(User)
         # opt_log
         self.opt_logger.info(user, content='用户登录限制编辑', remarks='用户登录限制编辑')
         return self.render_to_json_response(data=data)
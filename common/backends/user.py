@@ -1,9 +1,123 @@
+import typing
+from itertools import chain
+
 from django.contrib.auth import get_user_model
+from django.db.models.signals import post_migrate
 
-from base.models import Permission
+from base.models import Permission, Group
+from common.core.cache import INVALIDATED_TIMEOUT, ModelBasedCache, invalidate
 
 User = get_user_model()
 
+EXCLUDED_APP_LABELS = ['contenttypes', 'sessions', 'admin']
+
+# Permissions of each user as an integer bitset (bit n is set for the permission whose
+# pk is n), identifiers are user ids, PERMISSION_INDEX holds the PermissionIndex of all
+# permissions. Keys contain the generations of Permission and the intermediate models
+# below, which are bumped by m2m_changed (see common.core.cache), so changes of roles or
+# permissions take effect at once and the long timeout only removes keys of old generations.
+PERMISSION_INDEX = 'index'
+permission_cache = ModelBasedCache(
+    Permission, timeout=INVALIDATED_TIMEOUT, disable_warnings=True, name='base_permission_bitsets',
+    depends_on=(User.groups.through, User.user_permissions.through, Group.permissions.through)
+)
+
+
+class PermissionIndex(object):
+    """
+    Registry of all permissions, each permission string is mapped to a bit (its pk),
+    permissions of a user are an integer with the bits of their permissions set
+    """
+
+    def __init__(self, rows: typing.Iterable[typing.Tuple[int, str, str]]):
+        # 'app_label.codename' -> bit
+        self.bits = dict()
+        # bit -> 'app_label.codename'
+        self.names = dict()
+        # app_label -> bitset of all permissions of the app
+        self.app_masks = dict()
+        self.all_mask = 0
+        for pk, app_label, codename in rows:
+            name = "%s.%s" % (app_label, codename)
+            bit = 1 << pk
+            self.bits[name] = pk
+            self.names[pk] = name
+            self.app_masks[app_label] = self.app_masks.get(app_label, 0) | bit
+            self.all_mask |= bit
+
+    def encode(self, perms: typing.Iterable[str]) -> int:
+        bitset = 0
+        for name in perms:
+            if name in self.bits:
+                bitset |= 1 << self.bits[name]
+        return bitset
+
+    def decode(self, bitset: int) -> set:
+        perms = set()
+        while bitset:
+            lowest = bitset & -bitset
+            # bits of deleted permissions are ignored
+            name = self.names.get(lowest.bit_length() - 1)
+            if name is not None:
+                perms.add(name)
+            bitset ^= lowest
+        return perms
+
+    def has_perm(self, bitset: int, perm: str) -> bool:
+        bit = self.bits.get(perm)
+        return bit is not None and bool(bitset >> bit & 1)
+
+    def has_module_perms(self, bitset: int, app_label: str) -> bool:
+        return bool(bitset & self.app_masks.get(app_label, 0))
+
+
+def load_permission_index() -> PermissionIndex:
+    return PermissionIndex(Permission.objects.values_list(
+        'pk', 'content_type__app_label', 'codename').order_by())
+
+
+def load_permissions(user_ids) -> dict:
+    """
+    Return {user_id: bitset} of the given users, including permissions from their
+    groups, with two queries. Superusers are not special-cased.
+    """
+    user_ids = list(user_ids)
+    perms = {user_id: 0 for user_id in user_ids}
+    if not user_ids:
+        return perms
+    user_perms = User.user_permissions.through.objects.filter(
+        user_id__in=user_ids
+    ).exclude(
+        permission__content_type__app_label__in=EXCLUDED_APP_LABELS
+    ).values_list('user_id', 'permission_id')
+    user_groups_field = User._meta.get_field('groups')
+    user_groups_query = 'group__%s' % user_groups_field.related_query_name()
+    group_perms = Permission.objects.filter(
+        **{user_groups_query + '__in': user_ids}
+    ).exclude(
+        content_type__app_label__in=EXCLUDED_APP_LABELS
+    ).values_list(user_groups_query, 'pk').order_by()
+    for user_id, pk in chain(user_perms, group_perms):
+        perms[user_id] |= 1 << pk
+    return perms
+
+
+def _load_cached_permissions(identifiers: list) -> dict:
+    result = dict()
+    if PERMISSION_INDEX in identifiers:
+        result[PERMISSION_INDEX] = load_permission_index()
+    user_ids = [int(i) for i in identifiers if i != PERMISSION_INDEX]
+    result.update({str(user_id): bitset for user_id, bitset in load_permissions(user_ids).items()})
+    return result
+
+
+def _on_post_migrate(**kwargs):
+    # permissions are created by bulk_create() after migrating, which sends no post_save
+    invalidate(Permission)
+
+
+post_migrate.connect(_on_post_migrate, dispatch_uid='permission_cache_post_migrate')
+
 
 class UserAuthBackend(object):
     """
@@ -34,13 +148,13 @@ class UserAuthBackend(object):
 
     def _get_user_permissions(self, user_obj):
         return user_obj.user_permissions.exclude(
-            content_type__app_label__in=['contenttypes', 'sessions', 'admin'])
+            content_type__app_label__in=EXCLUDED_APP_LABELS)
 
     def _get_group_permissions(self, user_obj):
         user_groups_field = get_user_model()._meta.get_field('groups')
         user_groups_query = 'group__%s' % user_groups_field.related_query_name()
         perms = Permission.objects.exclude(
-            content_type__app_label__in=['contenttypes', 'sessions', 'admin'])
+            content_type__app_label__in=EXCLUDED_APP_LABELS)
         return perms.filter(**{user_groups_query: user_obj})
 
     def _get_permissions(self, user_obj, obj, from_name):
@@ -78,30 +192,51 @@ class UserAuthBackend(object):
         """
         return self._get_permissions(user_obj, obj, 'group')
 
+    def _get_permission_bits(self, user_obj) -> typing.Tuple[PermissionIndex, int]:
+        """
+        Return the PermissionIndex and the permission bitset of `user_obj`, both are
+        fetched from permission_cache with one round trip and kept on `user_obj`.
+        """
+        if not hasattr(user_obj, '_perm_bits'):
+            user_key = str(user_obj.pk)
+            if user_obj.is_superuser:
+                identifiers = [PERMISSION_INDEX]
+            else:
+                identifiers = [PERMISSION_INDEX, user_key]
+            data = permission_cache.get_many(identifiers, loader=_load_cached_permissions)
+            user_obj._perm_index = data[PERMISSION_INDEX]
+            if user_obj.is_superuser:
+                user_obj._perm_bits = user_obj._perm_index.all_mask
+            else:
+                user_obj._perm_bits = data[user_key]
+        return user_obj._perm_index, user_obj._perm_bits
+
     def get_all_permissions(self, user_obj, obj=None):
+        """
+        Return a set of permission strings of `user_obj`, decoded from the bitset
+        answered by the shared permission_cache.
+        """
         if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
             return set()
         if not hasattr(user_obj, '_perm_cache'):
-            user_obj._perm_cache = set()
-            user_obj._perm_cache.update(self.get_user_permissions(user_obj))
-            user_obj._perm_cache.update(self.get_group_permissions(user_obj))
+            index, bitset = self._get_permission_bits(user_obj)
+            user_obj._perm_cache = index.decode(bitset)
         return user_obj._perm_cache
 
     def has_perm(self, user_obj, perm, obj=None):
-        if not user_obj.is_active:
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
             return False
-        return perm in self.get_all_permissions(user_obj, obj)
+        index, bitset = self._get_permission_bits(user_obj)
+        return index.has_perm(bitset, perm)
 
     def has_module_perms(self, user_obj, app_label):
         """
         Return True if user_obj has any permissions in the given app_label.
         """
-        if not user_obj.is_active:
+        if not user_obj.is_active or user_obj.is_anonymous:
             return False
-        for perm in self.get_all_permissions(user_obj):
-            if perm[:perm.index('.')] == app_label:
-                return True
-        return False
+        index, bitset = self._get_permission_bits(user_obj)
+        return index.has_module_perms(bitset, app_label)
 
     def get_user(self, user_id):
         try:
@@ -1,16 +1,35 @@
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
 import typing
 import warnings
 
 from django.apps import apps
 from django.conf import settings
 from django.core.cache import cache, caches
+from django.db import transaction
+from django.db.models import QuerySet
 from django.db.models.base import ModelBase
+from django.db.models.signals import class_prepared, post_save, post_delete, m2m_changed
 
+from common.core import cache_metrics
+from common.core.cache_codecs import ZlibCodec
 from common.utils.general import ClsHelper
 
 __all__ = [
+    'CachedRows',
     'GenericBasedCache',
     'ModelBasedCache',
+    'INVALIDATED_TIMEOUT',
+    'get_generation',
+    'get_generations',
+    'invalidate',
+    'register_invalidation',
+    'LocalCache',
+    'get_local_cache',
+    'get_tier_stats',
     'queryset_cache'  # a shortcut
 ]
 
@@ -19,32 +38,494 @@ if not settings.configured:
     settings.configure()
 
 
+# Every ModelBasedCache key contains the generation of its model, bumping the generation
+# makes all cached data of that model stale at once. Stale keys are never read or deleted
+# again, only their timeout removes them: memcached evicts them by LRU, but redis does not
+# evict keys without expiry (maxmemory-policy noeviction by default), so caches relying on
+# invalidation must still have a finite timeout, e.g. INVALIDATED_TIMEOUT.
+GENERATION_KEY = '%s_generation'
+# Timeout of caches which are kept fresh by invalidation rather than expiry
+INVALIDATED_TIMEOUT = 12 * 60 * 60
+
+# Labels (app_label.model_name) of concrete models whose changes bump generations
+_invalidation_registry = set()
+
+
+def _get_model_label(model_cls) -> str:
+    # proxy models (e.g. base.Group) share the generation with their concrete model
+    return model_cls._meta.concrete_model._meta.label_lower
+
+
+def _initial_generation() -> int:
+    # Time based rather than 1, so that a generation re-created after eviction
+    # never collides with keys written under the evicted one.
+    return time.time_ns() // 1000
+
+
+def get_generations(model_classes: typing.Iterable[typing.Union[ModelBase, str]]) -> list:
+    """
+    Return current generations of the given models, in one round trip normally
+    """
+    keys = [GENERATION_KEY % _get_model_label(apps.get_model(m) if isinstance(m, str) else m)
+            for m in model_classes]
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        for key in missing:
+            cache.add(key, _initial_generation(), None)
+        generations.update(cache.get_many(missing))
+    return [generations.get(key) for key in keys]
+
+
+def get_generation(model_cls: typing.Union[ModelBase, str]) -> int:
+    """
+    Return current generation of the given model
+    """
+    return get_generations([model_cls])[0]
+
+
+def invalidate(model_cls: typing.Union[ModelBase, str], using: str = None):
+    """
+    Make all cached data of the given model stale.
+
+    Saving, deleting and m2m changing of registered models call this automatically,
+    call it manually after QuerySet.update(), bulk_create() or raw SQL, which send
+    no signals.
+
+    Inside a transaction the generation is bumped now and once more after the
+    transaction commits, so that data cached by concurrent readers before the commit
+    (old rows under the new generation) becomes stale too.
+    """
+    model_cls = apps.get_model(model_cls) if isinstance(model_cls, str) else model_cls
+    _bump_generation(model_cls)
+    if transaction.get_connection(using).in_atomic_block:
+        transaction.on_commit(lambda: _bump_generation(model_cls), using=using)
+
+
+def _bump_generation(model_cls):
+    key = GENERATION_KEY % _get_model_label(model_cls)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # generation does not exist or has been evicted
+        if not cache.add(key, _initial_generation(), None):
+            cache.incr(key)
+
+
+def register_invalidation(model_cls: typing.Union[ModelBase, str]):
+    """
+    Bump the generation of model_cls on post_save, post_delete and m2m_changed
+    """
+    model_cls = apps.get_model(model_cls) if isinstance(model_cls, str) else model_cls
+    label = _get_model_label(model_cls)
+    if label in _invalidation_registry:
+        return
+    _invalidation_registry.add(label)
+    # signals are sent with the proxy class as sender when saving a proxy instance
+    for models in list(apps.all_models.values()):
+        for m in list(models.values()):
+            if _get_model_label(m) == label:
+                _connect_receivers(m)
+
+
+def _connect_receivers(model_cls):
+    # Receivers are connected per model rather than without sender, so that other models
+    # pay nothing for signals and still can be fast deleted (see Collector.can_fast_delete).
+    post_save.connect(_on_model_changed, sender=model_cls, dispatch_uid='cache_invalidation_post_save')
+    post_delete.connect(_on_model_changed, sender=model_cls, dispatch_uid='cache_invalidation_post_delete')
+    for f in model_cls._meta.get_fields(include_hidden=True):
+        if not f.many_to_many:
+            continue
+        through = f.remote_field.through if f.concrete else f.through
+        if not isinstance(through, str):
+            m2m_changed.connect(_on_m2m_changed, sender=through,
+                                dispatch_uid='cache_invalidation_m2m_changed')
+    # in case model_cls is an intermediate model itself (see ModelBasedCache.depends_on)
+    m2m_changed.connect(_on_m2m_changed, sender=model_cls, dispatch_uid='cache_invalidation_m2m_changed')
+
+
+def _on_class_prepared(sender, **kwargs):
+    # proxies of registered models defined afterwards
+    if _get_model_label(sender) in _invalidation_registry:
+        _connect_receivers(sender)
+
+
+def _on_model_changed(sender, using=None, **kwargs):
+    invalidate(sender, using=using)
+
+
+def _on_m2m_changed(sender, instance, action, model, using=None, **kwargs):
+    if not action.startswith('post_'):
+        return
+    # sender is the intermediate model, both sides of the relation may be cached
+    for model_cls in {instance.__class__, model, sender}:
+        if _get_model_label(model_cls) in _invalidation_registry:
+            invalidate(model_cls, using=using)
+
+
+class_prepared.connect(_on_class_prepared, dispatch_uid='cache_invalidation_class_prepared')
+
+
+# Single-flight refill: on a miss only the worker holding the lock loads data, the others
+# wait for it. Values are stored as (value, delta, expiry), delta is the seconds spent
+# on loading, used for probabilistic early recomputation (XFetch), so that a hot key is
+# refilled by one worker shortly before it expires instead of by all workers after.
+REFILL_LOCK_TIMEOUT = 10
+REFILL_WAIT_INTERVAL = 0.05
+XFETCH_BETA = 1.0
+
+
+def _store(backend, key, value, delta, timeout, codec=None):
+    expiry = time.time() + timeout if timeout else None
+    data = codec.encode(value) if codec else value
+    backend.set(key, (data, delta, expiry), timeout)
+
+
+def _load(prefix, loader, codec=None):
+    """
+    Call loader and record the miss of prefix with its duration and value,
+    return the value and its encoded data (the value itself without codec)
+    """
+    start = time.monotonic()
+    value = loader()
+    data = codec.encode(value) if codec else value
+    cache_metrics.record(prefix, False, time.monotonic() - start, data)
+    return value, data
+
+
+def _refill(backend, key, loader, timeout, prefix=None, codec=None):
+    start = time.monotonic()
+    try:
+        value, data = _load(prefix or key, loader, codec=codec)
+        expiry = time.time() + timeout if timeout else None
+        backend.set(key, (data, time.monotonic() - start, expiry), timeout)
+    finally:
+        backend.delete(key + '_lock')
+    return value
+
+
+def _single_flight_get(backend, key, loader, timeout, beta=XFETCH_BETA, prefix=None,
+                       codec=None):
+    """
+    Get value of key from backend, loader is called once cluster-wide on a miss
+
+    prefix: name used by metrics, defaults to key
+    codec: see common.core.cache_codecs
+    """
+    prefix = prefix or key
+    decode = codec.decode if codec else lambda x: x
+    if timeout == 0:
+        # don't cache
+        return _load(prefix, loader)[0]
+    lock_key = key + '_lock'
+    envelope = backend.get(key)
+    if envelope is not None:
+        data, delta, expiry = envelope
+        # -log(x) for x in (0, 1] is an exponential random variable
+        if expiry is None or time.time() - delta * beta * math.log(1 - random.random()) < expiry:
+            cache_metrics.record(prefix, True)
+            return decode(data)
+        if not backend.add(lock_key, 1, REFILL_LOCK_TIMEOUT):
+            # another worker is recomputing, the current value is still valid
+            cache_metrics.record(prefix, True)
+            return decode(data)
+        return _refill(backend, key, loader, timeout, prefix=prefix, codec=codec)
+
+    deadline = time.monotonic() + REFILL_LOCK_TIMEOUT
+    while not backend.add(lock_key, 1, REFILL_LOCK_TIMEOUT):
+        time.sleep(REFILL_WAIT_INTERVAL)
+        envelope = backend.get(key)
+        if envelope is not None:
+            # refilled by another worker
+            cache_metrics.record(prefix, True)
+            return decode(envelope[0])
+        if time.monotonic() > deadline:
+            # the lock holder may be dead, load by self
+            return _load(prefix, loader)[0]
+    return _refill(backend, key, loader, timeout, prefix=prefix, codec=codec)
+
+
+# A local (per-process) copy of a key is dropped when the generation of that key stored
+# in the shared cache changes. The generation is checked at most once per check_interval
+# per key and process, so local copies are dropped by all workers within check_interval
+# after the value changes.
+LOCAL_GENERATION_KEY = 'local_cache_generation_%s'
+
+_missing = object()
+
+
+class LocalCache(object):
+    """
+    A bounded LRU cache with timeout in front of a shared cache (memcached/redis)
+    """
+
+    def __init__(self, backend, maxsize: int = 1024, timeout: int = 300, check_interval: int = 1):
+        self.backend = backend
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.check_interval = check_interval
+        # key -> [value, expiry, generation, checked_at]
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            'local': {'hits': 0, 'misses': 0},
+            'shared': {'hits': 0, 'misses': 0},
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_generation(self, key):
+        """
+        Return the shared generation of key, read it before loading the value to be set
+        """
+        return self.backend.get(LOCAL_GENERATION_KEY % key)
+
+    def get(self, key):
+        """
+        Return the value of key, or _missing if it does not exist, has expired or has
+        been changed by any process
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= now:
+                del self._data[key]
+                entry = None
+        if entry is not None and now - entry[3] >= self.check_interval:
+            generation = self.get_generation(key)
+            with self._lock:
+                if generation != entry[2]:
+                    self._data.pop(key, None)
+                    entry = None
+                else:
+                    entry[3] = now
+        with self._lock:
+            if entry is None:
+                self.stats['local']['misses'] += 1
+                return _missing
+            if key in self._data:
+                self._data.move_to_end(key)
+            self.stats['local']['hits'] += 1
+            return entry[0]
+
+    def set(self, key, value, timeout: int = None, generation=None):
+        """
+        generation: the value of get_generation(key) read before the value was loaded
+        """
+        timeout = self.timeout if timeout is None else timeout
+        now = time.monotonic()
+        expiry = now + timeout if timeout else None
+        with self._lock:
+            self._data[key] = [value, expiry, generation, now]
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def invalidate(self, key):
+        """
+        Drop local copies of key in all processes, return the new generation of key
+        """
+        generation_key = LOCAL_GENERATION_KEY % key
+        try:
+            generation = self.backend.incr(generation_key)
+        except ValueError:
+            generation = _initial_generation()
+            if not self.backend.add(generation_key, generation, None):
+                generation = self.backend.incr(generation_key)
+        self.delete(key)
+        return generation
+
+
+_local_caches = dict()
+
+
+def get_local_cache(driver='default') -> LocalCache:
+    """
+    Return the per-process LocalCache in front of caches[driver]
+    """
+    if driver not in _local_caches:
+        _local_caches.setdefault(driver, LocalCache(caches[driver]))
+    return _local_caches[driver]
+
+
+def get_tier_stats() -> dict:
+    """
+    Hits and misses of local and shared tiers for each driver in this process
+    """
+    return {driver: dict(local_cache.stats, size=len(local_cache))
+            for driver, local_cache in _local_caches.items()}
+
+
 class GenericBasedCache(object):
 
-    def __init__(self, name: str, driver='default'):
+    def __init__(self, name: str, driver='default', timeout: int = None, single_flight=False,
+                 two_tier=False):
+        """
+        single_flight: 缓存不存在时仅由一个进程调用default并回填，其他进程等待其结果，
+        开启后缓存值的存储格式与其他方式不兼容，不要再直接通过cache读取
+        two_tier: 在共享缓存前增加进程内LRU缓存，适用于很少变动的数据（如系统设置、权限），
+        本地缓存的超时时间不超过timeout，通过set更新后，所有进程中该缓存的本地副本在
+        LocalCache.check_interval秒内失效，不影响其他缓存
+        """
         assert driver in ('default', 'redis')
         self.cache = caches[driver]
+        self.driver = driver
         self.name = name
+        self.timeout = timeout
+        self.single_flight = single_flight
+        self.two_tier = two_tier
+
+    def _get_local_timeout(self, timeout: int = None):
+        # local copies never outlive the shared ones
+        timeout = self.timeout if timeout is None else timeout
+        local_timeout = get_local_cache(self.driver).timeout
+        return local_timeout if timeout is None else min(timeout, local_timeout)
 
     def get(self, default=None, **kwargs):
-        value = self.cache.get(self.name)
-        if value is None and default:
-            # cache not exists
-            if callable(default):
-                value = default(**kwargs)
-                self.set(value)
-                return default(**kwargs)
-            self.set(default)
-            return default
+        if not self.two_tier:
+            return self._get_shared(default, **kwargs)
+        local_cache = get_local_cache(self.driver)
+        value = local_cache.get(self.name)
+        if value is _missing:
+            generation = local_cache.get_generation(self.name)
+            value = self._get_shared(default, **kwargs)
+            timeout = self._get_local_timeout()
+            if value is not None and timeout != 0:
+                local_cache.set(self.name, value, timeout=timeout, generation=generation)
+        return value
+
+    def _get_shared(self, default=None, **kwargs):
+        missed = False
+
+        def loader():
+            nonlocal missed
+            missed = True
+            return default(**kwargs) if callable(default) else default
+
+        if self.single_flight:
+            if default:
+                value = _single_flight_get(self.cache, self.name, loader, self.timeout)
+            else:
+                envelope = self.cache.get(self.name)
+                value = None if envelope is None else envelope[0]
+                missed = envelope is None
+                cache_metrics.record(self.name, not missed)
+        else:
+            value = self.cache.get(self.name)
+            if value is None:
+                missed = True
+                if default:
+                    # cache not exists
+                    value = _load(self.name, loader)[0]
+                    self._set_shared(value)
+                else:
+                    cache_metrics.record(self.name, False)
+            else:
+                cache_metrics.record(self.name, True)
+        if self.two_tier:
+            get_local_cache(self.driver).stats['shared']['misses' if missed else 'hits'] += 1
         return value
 
+    def _set_shared(self, value, timeout: int = None):
+        timeout = self.timeout if timeout is None else timeout
+        if self.single_flight:
+            _store(self.cache, self.name, value, 0, timeout)
+        else:
+            self.cache.set(self.name, value, timeout)
+
     def set(self, value: str, timeout: int = None):
         """
         Caution: if you set timeout to an integer,
         you should not forget to update your cache manually,
         or the cache will expire after given time.
         """
-        self.cache.set(self.name, value, timeout)
+        self._set_shared(value, timeout)
+        if self.two_tier:
+            local_cache = get_local_cache(self.driver)
+            generation = local_cache.invalidate(self.name)
+            timeout = self._get_local_timeout(timeout)
+            if timeout != 0:
+                local_cache.set(self.name, value, timeout=timeout, generation=generation)
+
+
+class CachedRows(object):
+    """
+    Materialized rows of a model, each row is a tuple of field values in order of fields.
+
+    Columns in index_by are indexed when rows are loaded from database (the index is
+    cached along with rows), lookups on them cost a dict lookup instead of a scan.
+    """
+
+    def __init__(self, fields: typing.Iterable[str], rows: typing.Iterable[tuple],
+                 index_by: typing.Iterable[str] = None):
+        self.fields = tuple(fields)
+        self.rows = [tuple(row) for row in rows]
+        self.indexes = dict()
+        for column in index_by or ():
+            pos = self._get_position(column)
+            index = dict()
+            for i, row in enumerate(self.rows):
+                index.setdefault(row[pos], []).append(i)
+            self.indexes[column] = index
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.values())
+
+    def __repr__(self):
+        return '<%s %s (%d rows)>' % (self.__class__.__name__, self.fields, len(self.rows))
+
+    def _get_position(self, column):
+        try:
+            return self.fields.index(column)
+        except ValueError:
+            raise LookupError("'%s' is not a cached field, choices are: %s." %
+                              (column, ', '.join(self.fields)))
+
+    def _to_dict(self, row):
+        return dict(zip(self.fields, row))
+
+    def values(self) -> typing.List[dict]:
+        return [self._to_dict(row) for row in self.rows]
+
+    def filter_cached(self, **lookups) -> typing.List[dict]:
+        """
+        Return rows (as dicts like QuerySet.values()) exactly matching all lookups,
+        e.g. filter_cached(user_id=1). Only exact lookups of cached fields are supported.
+        """
+        positions = None
+        rest = dict()
+        for column, value in lookups.items():
+            if column in self.indexes:
+                matched = self.indexes[column].get(value, ())
+                if positions is None:
+                    positions = matched
+                else:
+                    matched = set(matched)
+                    positions = [i for i in positions if i in matched]
+            else:
+                rest[self._get_position(column)] = value
+        rows = self.rows if positions is None else [self.rows[i] for i in positions]
+        return [self._to_dict(row) for row in rows
+                if all(row[pos] == value for pos, value in rest.items())]
+
+    def get_cached(self, **lookups) -> typing.Union[dict, None]:
+        """
+        Return the first row matching lookups, or None
+        """
+        rows = self.filter_cached(**lookups)
+        return rows[0] if rows else None
 
 
 class ModelBasedCache(object):
@@ -68,25 +549,58 @@ class ModelBasedCache(object):
         func默认是不带参数的函数，如果需要自定义参数，配合args和kwargs参数使用
         args: func的位置参数
         kwargs: func的关键字参数
+
+        auto_invalidate: 默认True，model_cls的数据保存、删除或多对多关系变动时缓存自动失效，
+        因此timeout可以设置得较长
+        single_flight: 默认False，缓存不存在时仅由一个进程查询数据库并回填，并在过期前提前刷新热点缓存
+        materialize: 默认False，为True时缓存的是CachedRows（字段值元组）而不是QuerySet，
+        可以通过filter_cached在内存中查询，不再访问数据库
+        fields: materialize时缓存的字段，默认为所有字段（外键为xxx_id）
+        index_by: materialize时建立索引的字段
+        codec: 缓存数据的编码方式，见common.core.cache_codecs，如ZlibCodec可压缩较大的数据
+        depends_on: 数据还依赖的其他model（如多对多的中间表），它们变动时缓存同样失效
+        name: 缓存key和指标（见common.core.cache_metrics）的前缀，默认为APP_LABEL_MODEL_NAME，
+        与QuerySetCache相同；同一model的其他缓存应使用不同的name，否则指标会混在一起
         """
         self.model_cls = apps.get_model(model_cls) if isinstance(model_cls, str) else model_cls
-        self.name = '%s_%s' % (self.model_cls._meta.app_label, self.model_cls.__class__.__name__)
+        self.name = kwargs.get('name') or '%s_%s' % (self.model_cls._meta.app_label, self.model_cls.__name__)
         self.timeout = timeout
         # self.host = default_settings['host']  # multiple developments
         self.func = func
         self.disable_warnings = kwargs.get('disable_warnings', False)
+        self.auto_invalidate = kwargs.get('auto_invalidate', True)
+        self.single_flight = kwargs.get('single_flight', False)
+        self.materialize = kwargs.get('materialize', False)
+        self.fields = kwargs.get('fields') or [f.attname for f in self.model_cls._meta.concrete_fields]
+        self.index_by = kwargs.get('index_by')
+        self.codec = kwargs.get('codec')
+        self.depends_on = [apps.get_model(m) if isinstance(m, str) else m
+                           for m in kwargs.get('depends_on', ())]
+        if self.auto_invalidate:
+            for m in [self.model_cls] + self.depends_on:
+                register_invalidation(m)
 
     def _get_from_db(self, func, *args, **kwargs):
         if func:
-            if callable(func):
-                return func(*args, **kwargs)
-            return func
-        return self.model_cls._meta.default_manager.all()
+            data = func(*args, **kwargs) if callable(func) else func
+        else:
+            data = self.model_cls._meta.default_manager.all()
+        if self.materialize and isinstance(data, QuerySet):
+            data = CachedRows(self.fields, data.values_list(*self.fields), index_by=self.index_by)
+        return data
 
-    def _get_key(self, identifiers):
+    def _get_prefix(self):
         conn = '_'
         # name = self.host + conn + self.name
         name = self.name
+        if self.auto_invalidate:
+            generations = get_generations([self.model_cls] + self.depends_on)
+            name += conn + conn.join(map(str, generations))
+        return name
+
+    def _get_key(self, identifiers, prefix=None):
+        conn = '_'
+        name = prefix or self._get_prefix()
         if not identifiers:
             return name
         try:
@@ -100,6 +614,16 @@ class ModelBasedCache(object):
             key += conn.join(identifiers)
             return key
 
+    def _check_identifiers(self, identifiers):
+        if not identifiers and not self.disable_warnings:
+            warnings.warn('An unique identifier is strongly recommended.', UserWarning)
+
+    def _encode(self, value):
+        return self.codec.encode(value) if self.codec else value
+
+    def _decode(self, data):
+        return self.codec.decode(data) if self.codec else data
+
     def get(self, identifiers: typing.Union[str, typing.Iterable] = None, func=None,
             *args, **kwargs):
         """
@@ -108,12 +632,23 @@ class ModelBasedCache(object):
         identifier是一个或多个动态的字符串用于细分每个缓存（比如可以是不同用户的名字），强烈建议，否则可能导致数据错误
         其他参数同构造器
         """
-        data = cache.get(self._get_key(identifiers))
+        key = self._get_key(identifiers)
         func = func or self.func
+        if self.single_flight:
+            self._check_identifiers(identifiers)
+            return _single_flight_get(
+                cache, key, lambda: self._get_from_db(func, *args, **kwargs), self.timeout,
+                prefix=self.name, codec=self.codec)
+        data = cache.get(key)
         if data is None:
-            data = self._get_from_db(func, *args, **kwargs)
-            self.set(identifiers=identifiers, func=func, *args, **kwargs)
-        return data
+            self._check_identifiers(identifiers)
+            value, data = _load(self.name, lambda: self._get_from_db(func, *args, **kwargs),
+                                codec=self.codec)
+            # 0 means cache without timeout
+            cache.set(key, data, self.timeout)
+            return value
+        cache_metrics.record(self.name, True)
+        return self._decode(data)
 
     def set(self, identifiers: typing.Union[str, typing.Iterable] = None, func=None,
             *args, **kwargs):
@@ -122,11 +657,59 @@ class ModelBasedCache(object):
 
         参数同get
         """
-        if not identifiers and not self.disable_warnings:
-            warnings.warn('An unique identifier is strongly recommended.', UserWarning)
+        self._check_identifiers(identifiers)
         func = func or self.func
+        key = self._get_key(identifiers)
+        if self.single_flight:
+            start = time.monotonic()
+            data = self._get_from_db(func, *args, **kwargs)
+            _store(cache, key, data, time.monotonic() - start, self.timeout, codec=self.codec)
+            return
         # 0 means cache without timeout
-        cache.set(self._get_key(identifiers), self._get_from_db(func, *args, **kwargs), self.timeout)
+        cache.set(key, self._encode(self._get_from_db(func, *args, **kwargs)), self.timeout)
+
+    def get_many(self, identifier_list: typing.Iterable[typing.Union[str, tuple]],
+                 loader: typing.Callable[[list], dict] = None) -> dict:
+        """
+        批量获取缓存的数据，返回{identifiers: data}
+
+        identifier_list中的每一项同get的identifiers（多个字符串时使用tuple）
+        loader: 批量查询函数，参数为缓存中不存在的identifiers列表，返回{identifiers: data}，
+        其结果会通过set_many写入缓存；为None时不存在的identifiers不会出现在返回值中
+        """
+        prefix = self._get_prefix()
+        keys = {self._get_key(identifiers, prefix=prefix): identifiers
+                for identifiers in identifier_list}
+        result = dict()
+        for key, data in cache.get_many(keys.keys()).items():
+            result[keys[key]] = self._decode(data[0] if self.single_flight else data)
+            cache_metrics.record(self.name, True)
+        missing = [identifiers for identifiers in keys.values() if identifiers not in result]
+        if missing and loader:
+            start = time.monotonic()
+            loaded = loader(missing)
+            duration = (time.monotonic() - start) / len(missing)
+            encoded = {identifiers: self._encode(value) for identifiers, value in loaded.items()}
+            for data in encoded.values():
+                cache_metrics.record(self.name, False, duration, data)
+            self._set_many_encoded(encoded, prefix)
+            result.update(loaded)
+        return result
+
+    def set_many(self, mapping: typing.Dict[typing.Union[str, tuple], typing.Any], prefix=None):
+        """
+        批量写入缓存，mapping为{identifiers: data}
+        """
+        encoded = {identifiers: self._encode(value) for identifiers, value in mapping.items()}
+        self._set_many_encoded(encoded, prefix or self._get_prefix())
+
+    def _set_many_encoded(self, mapping, prefix):
+        expiry = time.time() + self.timeout if self.timeout else None
+        data = dict()
+        for identifiers, value in mapping.items():
+            data[self._get_key(identifiers, prefix=prefix)] = (
+                (value, 0, expiry) if self.single_flight else value)
+        cache.set_many(data, self.timeout)
 
 
 class QuerySetCache(ClsHelper):
@@ -147,7 +730,8 @@ class QuerySetCache(ClsHelper):
         }
 
     If _cached_models is defined, attributes will be restrict by it.
-    On contrary, if it is not defined, all app model attributes is available.
+    On contrary, if it is not defined, the attributes declared in the class are available.
+    Models not declared are not cached, and their changes do not touch the cache.
 
     2. Import queryset_cache to your file and use it.
 
@@ -157,6 +741,24 @@ class QuerySetCache(ClsHelper):
         last_login__year=timezone.now().year
     )
 
+    3. Models in _materialized_models are cached as CachedRows (tuples of field values)
+    rather than QuerySets, the values are the fields to be indexed.
+
+    class QuerySetCache(object):
+        _materialized_models = {
+            'base_LoginTerminal': ('user_id',),
+        }
+
+    terminal = queryset_cache.base_LoginTerminal.get_cached(user_id=user.pk)
+
+    4. Values of attributes in _codecs are encoded by the given codec before being sent
+    to the cache backend (see common.core.cache_codecs).
+
+    class QuerySetCache(object):
+        _codecs = {
+            'base_Permission': ZlibCodec(),
+        }
+
     Alternatively you can define a new class inherits from QuerySetCache and use it.
 
     [NOTICE]
@@ -166,11 +768,15 @@ class QuerySetCache(ClsHelper):
     _default_timeout: int = 10
 
     # fixme: add more -> APP_NAME_MODEL_NAME = TIMEOUT
-    base_Group: int = 30
-    base_User = 10
-    base_Permission = None  # None means will not timeout
-    # If you define an attribute to use a model cache and set it to None, please update
-    # cache in signals respectively. If it was set to 0, that model will never be cached.
+    base_Group: int = 3600
+    base_User = 600
+    base_Permission = INVALIDATED_TIMEOUT
+    base_LoginTerminal = 3600
+    # Caches are invalidated on post_save, post_delete and m2m_changed of the model, so
+    # long timeouts are safe. Changes which send no signals (QuerySet.update, bulk_create,
+    # raw SQL) must be followed by common.core.cache.invalidate(model).
+    # If it was set to 0, that model will never be cached. None (never expire) leaves the
+    # keys of old generations in the cache forever, see GENERATION_KEY.
 
     # Optional restriction attributes
     # _cached_models = {
@@ -179,27 +785,66 @@ class QuerySetCache(ClsHelper):
     #     'base.User': 10,
     # }
 
+    # Models cached as CachedRows, {APP_NAME_MODEL_NAME: INDEX_FIELDS}
+    _materialized_models = {
+        'base_LoginTerminal': ('user_id',),
+    }
+
+    # Codecs of large values, {APP_NAME_MODEL_NAME: CODEC}
+    _codecs = {
+        'base_Permission': ZlibCodec(),
+    }
+
     def __init__(self):
         super().__init__()
         named_mappings = dict()
+        model_classes = dict()
         if self._cached_models:
             # some restriction
             for app_model, timeout in self._cached_models.items():
                 app_name, model_name = app_model.split('.')
-                app_models = apps.all_models.get(app_name)
-                if not app_models.get(model_name.lower()):
+                app_models = apps.all_models.get(app_name) or dict()
+                model_cls = app_models.get(model_name.lower())
+                if not model_cls:
                     raise LookupError('Model %s.%s does not exist.' % (app_name, model_name))
-                named_mappings['{0}_{1}'.format(app_name, model_name)] = timeout
+                attr = '{0}_{1}'.format(app_name, model_name)
+                named_mappings[attr] = timeout
+                model_classes[attr] = model_cls
         else:
-            for app_name, models in apps.all_models.items():
-                for _, model_cls in models.items():
-                    app_model = '{0}_{1}'.format(app_name, model_cls.__name__)
-                    named_mappings[app_model] = self._get_timeout(app_model)
+            # only the declared attributes, other models are neither cached nor invalidated
+            for attr in self._get_declared_attrs():
+                app_name, _, model_name = attr.partition('_')
+                model_cls = (apps.all_models.get(app_name) or dict()).get(model_name.lower())
+                if model_cls:
+                    named_mappings[attr] = self._get_timeout(attr)
+                    model_classes[attr] = model_cls
         object.__setattr__(self, '_named_mappings', named_mappings)
+        # One cache handle per model, built once, so attribute access costs a dict lookup.
+        # Handles register invalidation at construction rather than on first access,
+        # otherwise changes made in a process which has not read the cache yet would be missed.
+        model_caches = dict()
+        for attr, model_cls in model_classes.items():
+            model_caches[attr] = ModelBasedCache(
+                model_cls, timeout=named_mappings[attr], single_flight=True,
+                auto_invalidate=named_mappings[attr] != 0,
+                materialize=attr in self._materialized_models,
+                index_by=self._materialized_models.get(attr),
+                codec=self._codecs.get(attr)
+            )
+        object.__setattr__(self, '_model_caches', model_caches)
         for key in self.all_keys():
             if key not in named_mappings:
                 warnings.warn('%s is not a valid attribute.' % key, UserWarning)
 
+    @classmethod
+    def _get_declared_attrs(cls) -> list:
+        attrs = list()
+        for klass in reversed(cls.__mro__):
+            for key, value in vars(klass).items():
+                if not key.startswith('_') and not callable(value) and key not in attrs:
+                    attrs.append(key)
+        return attrs
+
     def __new__(cls, *args, **kwargs):
         cached_models = cls._cached_models if hasattr(cls, '_cached_models') and cls._cached_models else dict()
         setattr(cls, '_cached_models', cached_models)
@@ -214,32 +859,23 @@ class QuerySetCache(ClsHelper):
     def __getattribute__(self, name):
         if name.startswith('_'):
             return object.__getattribute__(self, name)
-        if name in self._named_mappings.keys():
-            model_cls = self._get_model_cls(name)
-            try:
-                timeout = object.__getattribute__(self, name)
-            except AttributeError:
-                timeout = self._default_timeout
-            return ModelBasedCache(model_cls, timeout=timeout).get(name)
+        model_cache = object.__getattribute__(self, '_model_caches').get(name)
+        if model_cache is not None:
+            return model_cache.get(name)
         return object.__getattribute__(self, name)
 
     def __dir__(self):
         return self._named_mappings.keys()
 
+    def refill(self, name):
+        """
+        Reload the cache of the given attribute from database
+        """
+        self._model_caches[name].set(name)
+
     def _get_timeout(self, app_model):
-        try:
-            return getattr(self, app_model)
-        except AttributeError:
-            return self._default_timeout
-
-    @staticmethod
-    def _get_model_cls(attr):
-        for app_name, models in apps.all_models.items():
-            for _, model_cls in models.items():
-                app_model = '{0}.{1}'.format(app_name, model_cls.__name__)
-                if app_model.replace('.', '_') == attr:
-                    return apps.get_model(app_model)
-        raise AttributeError
+        # look up the class, instance attributes are cached data
+        return getattr(self.__class__, app_model, self._default_timeout)
 
 
 queryset_cache = QuerySetCache()
@@ -0,0 +1,93 @@
+"""
+Codecs used to encode values of common.core.cache before they are sent to the cache
+backend, e.g. ModelBasedCache(..., codec=ZlibCodec(RowsCodec())).
+
+Without a codec values are pickled by the cache backend as they are.
+"""
+import pickle
+import zlib
+
+__all__ = [
+    'BaseCodec',
+    'PickleCodec',
+    'RowsCodec',
+    'ZlibCodec',
+]
+
+
+class BaseCodec(object):
+
+    def encode(self, value) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: bytes):
+        raise NotImplementedError
+
+
+class PickleCodec(BaseCodec):
+
+    def encode(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+
+class RowsCodec(PickleCodec):
+    """
+    Encode CachedRows as a plain (fields, rows, index_by) tuple, so that neither class
+    paths nor model instances are pickled. Indexes are rebuilt on decoding, trading a
+    little CPU for much smaller values.
+
+    QuerySets are rejected, they would be decoded as CachedRows and a cache would return
+    a QuerySet on misses but CachedRows on hits. Use it with ModelBasedCache(...,
+    materialize=True), which loads CachedRows in the first place.
+    """
+    _rows = 'r'
+    _raw = 'o'
+
+    def encode(self, value):
+        from django.db.models import QuerySet
+        from common.core.cache import CachedRows
+
+        if isinstance(value, QuerySet):
+            raise TypeError('RowsCodec does not encode QuerySets, cache them with materialize=True.')
+        if isinstance(value, CachedRows):
+            data = (self._rows, value.fields, value.rows, tuple(value.indexes))
+        else:
+            data = (self._raw, value)
+        return super().encode(data)
+
+    def decode(self, data):
+        from common.core.cache import CachedRows
+
+        data = super().decode(data)
+        if data[0] == self._rows:
+            _, fields, rows, index_by = data
+            return CachedRows(fields, rows, index_by=index_by)
+        return data[1]
+
+
+class ZlibCodec(BaseCodec):
+    """
+    Compress encoded values not smaller than threshold bytes
+    """
+    _plain = b'\x00'
+    _compressed = b'\x01'
+
+    def __init__(self, inner: BaseCodec = None, threshold: int = 1024, level: int = 6):
+        self.inner = inner or PickleCodec()
+        self.threshold = threshold
+        self.level = level
+
+    def encode(self, value):
+        data = self.inner.encode(value)
+        if len(data) < self.threshold:
+            return self._plain + data
+        return self._compressed + zlib.compress(data, self.level)
+
+    def decode(self, data):
+        flag, data = data[:1], data[1:]
+        if flag == self._compressed:
+            data = zlib.decompress(data)
+        return self.inner.decode(data)
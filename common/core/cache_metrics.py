@@ -0,0 +1,255 @@
+"""
+Instrumentation of common.core.cache
+
+Every hit and miss (refill) of GenericBasedCache, ModelBasedCache and QuerySetCache is
+recorded by key prefix (the name of the cache, without generations and identifiers) to
+a sink. The sink is configured by settings.CACHE_METRICS_SINK (dotted path of a sink
+class, None to disable), defaults to MemorySink which keeps recent events of the process
+in memory. Set it to 'common.core.cache_metrics.SharedCacheSink' to aggregate counters
+of all processes in the default cache, so that `python manage.py cache_stats` can
+report them.
+
+Sizes are those of the values encoded by a codec (see common.core.cache_codecs), other
+values are pickled to be measured for a sample of misses only, the rate is
+settings.CACHE_METRICS_SIZE_SAMPLE_RATE (0.01 by default, 0 to disable).
+"""
+import pickle
+import random
+import threading
+import time
+import typing
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+__all__ = [
+    'CacheEvent',
+    'BaseSink',
+    'MemorySink',
+    'SharedCacheSink',
+    'get_sink',
+    'record',
+]
+
+DEFAULT_SINK = 'common.core.cache_metrics.MemorySink'
+DEFAULT_SIZE_SAMPLE_RATE = 0.01
+
+METRICS_KEY = 'cache_metrics_%s_%s'
+# Registry of prefixes: a marker per prefix, and numbered slots holding the prefixes.
+# The process which adds the marker takes the next slot with incr, so concurrent
+# processes never overwrite each other.
+METRICS_PREFIX_KEY = 'cache_metrics_prefix_%s'
+METRICS_PREFIX_COUNT_KEY = 'cache_metrics_prefix_count'
+METRICS_PREFIX_SLOT_KEY = 'cache_metrics_prefix_slot_%d'
+METRICS_FIELDS = ('hits', 'misses', 'refill_us', 'size')
+
+
+class CacheEvent(typing.NamedTuple):
+    prefix: str
+    hit: bool
+    # seconds spent on refilling, 0 for hits
+    duration: float
+    # serialized size of the refilled value, None for hits and unmeasured values
+    size: typing.Optional[int]
+    timestamp: float
+
+
+def _new_summary():
+    return {'hits': 0, 'misses': 0, 'refill_time': 0.0, 'size': 0}
+
+
+def _finish_summary(summary: dict) -> dict:
+    for item in summary.values():
+        total = item['hits'] + item['misses']
+        item['hit_rate'] = item['hits'] / total if total else None
+        item['avg_refill_time'] = item['refill_time'] / item['misses'] if item['misses'] else None
+    return summary
+
+
+class BaseSink(object):
+
+    def record(self, event: CacheEvent):
+        raise NotImplementedError
+
+    def summary(self) -> typing.Dict[str, dict]:
+        """
+        Return {prefix: {hits, misses, hit_rate, refill_time, avg_refill_time, size}},
+        size is the largest serialized size seen
+        """
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+
+class MemorySink(BaseSink):
+    """
+    Keep the latest events of this process in a ring buffer
+    """
+
+    def __init__(self, maxlen: int = 10000):
+        self.events = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, event: CacheEvent):
+        with self._lock:
+            self.events.append(event)
+
+    def summary(self):
+        result = dict()
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            item = result.setdefault(event.prefix, _new_summary())
+            if event.hit:
+                item['hits'] += 1
+            else:
+                item['misses'] += 1
+                item['refill_time'] += event.duration
+                item['size'] = max(item['size'], event.size or 0)
+        return _finish_summary(result)
+
+    def reset(self):
+        with self._lock:
+            self.events.clear()
+
+
+class SharedCacheSink(MemorySink):
+    """
+    Besides the ring buffer, counters are aggregated locally and added to the default
+    cache every flush_interval seconds, summary() reports all processes.
+    """
+
+    def __init__(self, maxlen: int = 10000, flush_interval: int = 10):
+        super().__init__(maxlen=maxlen)
+        self.flush_interval = flush_interval
+        self._pending = dict()
+        self._flushed_at = time.monotonic()
+
+    def record(self, event: CacheEvent):
+        super().record(event)
+        with self._lock:
+            item = self._pending.setdefault(event.prefix, _new_summary())
+            if event.hit:
+                item['hits'] += 1
+            else:
+                item['misses'] += 1
+                item['refill_time'] += event.duration
+                item['size'] = max(item['size'], event.size or 0)
+            if time.monotonic() - self._flushed_at < self.flush_interval:
+                return
+            pending, self._pending = self._pending, dict()
+            self._flushed_at = time.monotonic()
+        self.flush(pending)
+
+    @staticmethod
+    def _incr(key, delta):
+        if not delta:
+            return
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            if not cache.add(key, delta, None):
+                cache.incr(key, delta)
+
+    @staticmethod
+    def _register_prefix(prefix):
+        if not cache.add(METRICS_PREFIX_KEY % prefix, 1, None):
+            # registered already
+            return
+        try:
+            slot = cache.incr(METRICS_PREFIX_COUNT_KEY)
+        except ValueError:
+            slot = 1 if cache.add(METRICS_PREFIX_COUNT_KEY, 1, None) else cache.incr(METRICS_PREFIX_COUNT_KEY)
+        cache.set(METRICS_PREFIX_SLOT_KEY % slot, prefix, None)
+
+    @staticmethod
+    def _get_prefixes() -> list:
+        count = cache.get(METRICS_PREFIX_COUNT_KEY) or 0
+        slots = cache.get_many([METRICS_PREFIX_SLOT_KEY % i for i in range(1, count + 1)])
+        return list(slots.values())
+
+    def flush(self, pending: dict = None):
+        if pending is None:
+            with self._lock:
+                pending, self._pending = self._pending, dict()
+        if not pending:
+            return
+        for prefix, item in pending.items():
+            self._register_prefix(prefix)
+            self._incr(METRICS_KEY % (prefix, 'hits'), item['hits'])
+            self._incr(METRICS_KEY % (prefix, 'misses'), item['misses'])
+            # microseconds, incr works on integers only
+            self._incr(METRICS_KEY % (prefix, 'refill_us'), int(item['refill_time'] * 1000000))
+            size_key = METRICS_KEY % (prefix, 'size')
+            if item['size'] > (cache.get(size_key) or 0):
+                cache.set(size_key, item['size'], None)
+
+    def summary(self):
+        self.flush()
+        prefixes = self._get_prefixes()
+        keys = [METRICS_KEY % (prefix, field) for prefix in prefixes for field in METRICS_FIELDS]
+        values = cache.get_many(keys)
+        result = dict()
+        for prefix in prefixes:
+            result[prefix] = {
+                'hits': values.get(METRICS_KEY % (prefix, 'hits'), 0),
+                'misses': values.get(METRICS_KEY % (prefix, 'misses'), 0),
+                'refill_time': values.get(METRICS_KEY % (prefix, 'refill_us'), 0) / 1000000,
+                'size': values.get(METRICS_KEY % (prefix, 'size'), 0),
+            }
+        return _finish_summary(result)
+
+    def reset(self):
+        super().reset()
+        with self._lock:
+            self._pending = dict()
+        count = cache.get(METRICS_PREFIX_COUNT_KEY) or 0
+        prefixes = self._get_prefixes()
+        cache.delete_many([METRICS_KEY % (prefix, field) for prefix in prefixes for field in METRICS_FIELDS] +
+                          [METRICS_PREFIX_KEY % prefix for prefix in prefixes] +
+                          [METRICS_PREFIX_SLOT_KEY % i for i in range(1, count + 1)])
+        cache.delete(METRICS_PREFIX_COUNT_KEY)
+
+
+_sink = None
+
+
+def get_sink() -> typing.Optional[BaseSink]:
+    global _sink
+    if _sink is None:
+        sink_path = getattr(settings, 'CACHE_METRICS_SINK', DEFAULT_SINK)
+        if sink_path is None:
+            return None
+        _sink = import_string(sink_path)()
+    return _sink
+
+
+def _get_size(value) -> typing.Optional[int]:
+    if isinstance(value, bytes):
+        # encoded by a codec
+        return len(value)
+    # pickling again doubles the cost of a refill, measure a sample only
+    if random.random() >= getattr(settings, 'CACHE_METRICS_SIZE_SAMPLE_RATE', DEFAULT_SIZE_SAMPLE_RATE):
+        return None
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        # unpicklable values can not be cached either, the cache will complain
+        return None
+
+
+_unset = object()
+
+
+def record(prefix: str, hit: bool, duration: float = 0.0, value=_unset):
+    """
+    Record a hit, or a miss along with its refill duration and the refilled value
+    """
+    sink = get_sink()
+    if sink is None:
+        return
+    size = None if value is _unset else _get_size(value)
+    sink.record(CacheEvent(prefix, hit, duration, size, time.time()))
@@ -0,0 +1,160 @@
+"""
+Presence (online status) of users
+
+Last seen timestamps of users are kept in a redis sorted set (member: user id, score:
+timestamp) by PresenceTracker, nothing is written to the database. They are updated by
+base.middleware.AccessControlMiddleware on HTTP requests and by the heartbeats of
+common.core.websocket.GlobalAsyncJsonWebsocketConsumer. A user is online if they have
+been idle for no longer than settings.USER_IDLE_TIMEOUT seconds (15 minutes by default).
+"""
+import threading
+import time
+import typing
+
+from django.conf import settings
+from redis import Redis, RedisError
+
+from common.core.settings import sys_settings
+from common.log import default_logger as logger
+
+__all__ = [
+    'PresenceTracker',
+    'tracker',
+    'touch',
+    'get_last_activity',
+    'get_online_status',
+    'is_online',
+    'get_online_users',
+    'count_online_users',
+]
+
+PRESENCE_KEY = 'presence_last_seen'
+DEFAULT_IDLE_TIMEOUT = 15 * 60
+# every process writes the activity of a user at most once per TOUCH_INTERVAL seconds
+TOUCH_INTERVAL = 30
+# seconds, presence is read and written on the request path, a hanging redis must not block it
+SOCKET_TIMEOUT = 2
+
+
+class PresenceTracker(object):
+    """
+    Updating or querying one user is O(log n), listing online users is O(log n + m)
+    """
+
+    def __init__(self, key: str = PRESENCE_KEY, client: Redis = None):
+        self.key = key
+        self._client = client
+
+    @property
+    def client(self) -> Redis:
+        if self._client is None:
+            self._client = Redis.from_url(
+                sys_settings.redis.default_location,
+                socket_connect_timeout=SOCKET_TIMEOUT, socket_timeout=SOCKET_TIMEOUT)
+        return self._client
+
+    def heartbeat(self, user_id, now: float = None):
+        now = time.time() if now is None else now
+        self.client.zadd(self.key, {str(user_id): now})
+
+    def remove(self, user_id):
+        self.client.zrem(self.key, str(user_id))
+
+    def last_seen(self, user_id) -> typing.Optional[float]:
+        return self.client.zscore(self.key, str(user_id))
+
+    def last_seen_many(self, user_ids: typing.Iterable) -> typing.Dict[typing.Any, typing.Optional[float]]:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return dict()
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zscore(self.key, str(user_id))
+        return dict(zip(user_ids, pipe.execute()))
+
+    def seen_since(self, since: float, offset: int = 0,
+                   limit: int = None) -> typing.List[typing.Tuple[int, float]]:
+        """
+        Return [(user_id, last_seen)] of users seen since the given timestamp, latest first
+        """
+        if limit is None:
+            members = self.client.zrevrangebyscore(self.key, '+inf', since, withscores=True)
+            members = members[offset:]
+        else:
+            members = self.client.zrevrangebyscore(
+                self.key, '+inf', since, start=offset, num=limit, withscores=True)
+        return [(int(member), score) for member, score in members]
+
+    def count_since(self, since: float) -> int:
+        return self.client.zcount(self.key, since, '+inf')
+
+
+tracker = PresenceTracker()
+
+_touched = dict()
+_lock = threading.Lock()
+
+
+def get_idle_timeout() -> int:
+    return getattr(settings, 'USER_IDLE_TIMEOUT', DEFAULT_IDLE_TIMEOUT)
+
+
+def _get_deadline(now: float = None) -> float:
+    return (time.time() if now is None else now) - get_idle_timeout()
+
+
+def touch(user_id, now: float = None, force: bool = False):
+    """
+    Record the activity of a user, force to skip throttling (e.g. on disconnecting)
+
+    Called on the request path, so errors of redis are logged rather than raised, the
+    next attempt is made after TOUCH_INTERVAL.
+    """
+    now = time.time() if now is None else now
+    with _lock:
+        if not force and now - _touched.get(user_id, 0) < TOUCH_INTERVAL:
+            return
+        _touched[user_id] = now
+    try:
+        tracker.heartbeat(user_id, now)
+    except RedisError as e:
+        logger.warning('Failed to record the activity of user %s: %s' % (user_id, e))
+
+
+def get_last_activity(user_ids: typing.Iterable) -> typing.Dict[typing.Any, typing.Optional[float]]:
+    """
+    Return {user_id: timestamp of the last activity or None}
+
+    Presence is additional data of the callers (e.g. the user list), so errors of
+    redis are logged and the activities are unknown (None) rather than raised.
+    """
+    user_ids = list(user_ids)
+    try:
+        return tracker.last_seen_many(user_ids)
+    except RedisError as e:
+        logger.warning('Failed to get the activity of users: %s' % e)
+        return dict.fromkeys(user_ids)
+
+
+def get_online_status(user_ids: typing.Iterable, now: float = None) -> typing.Dict[typing.Any, bool]:
+    """
+    Return {user_id: is_online}
+    """
+    deadline = _get_deadline(now)
+    return {user_id: timestamp is not None and timestamp >= deadline
+            for user_id, timestamp in get_last_activity(user_ids).items()}
+
+
+def is_online(user_id) -> bool:
+    return get_online_status([user_id])[user_id]
+
+
+def get_online_users(offset: int = 0, limit: int = None) -> typing.List[typing.Tuple[int, float]]:
+    """
+    Return [(user_id, last_seen)] of online users, latest first
+    """
+    return tracker.seen_since(_get_deadline(), offset=offset, limit=limit)
+
+
+def count_online_users() -> int:
+    return tracker.count_since(_get_deadline())
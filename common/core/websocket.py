@@ -1,4 +1,3 @@
-import json
 import typing
 
 from asgiref.sync import async_to_sync, sync_to_async
@@ -8,8 +7,9 @@ from channels.generic.websocket import AsyncJsonWebsocketConsumer as _AsyncJsonW
 from channels.layers import get_channel_layer
 from django.db.models import Model
 
+from common.core import presence
 from common.forms import model_to_dict
-from common.utils.json import CJsonEncoder
+from common.utils.json import dumps
 
 __all__ = (
     'push',
@@ -115,10 +115,7 @@ class AsyncJsonModelBasedWebsocketConsumer(_AsyncJsonWebsocketConsumer):
 
     @database_sync_to_async
     def get_data(self):
-        return json.dumps(
-            model_to_dict(self.model.objects.all()),
-            cls=CJsonEncoder
-        )
+        return dumps(model_to_dict(self.model.objects.all()))
 
 
 class AsyncJsonWebsocketConsumer(_AsyncJsonWebsocketConsumer):
@@ -126,23 +123,37 @@ class AsyncJsonWebsocketConsumer(_AsyncJsonWebsocketConsumer):
 
     @classmethod
     async def encode_json(cls, content):
-        return json.dumps(content, cls=CJsonEncoder)
+        return dumps(content)
 
 
 class GlobalAsyncJsonWebsocketConsumer(_AsyncJsonWebsocketConsumer):
     """
     DO NOT create a model named Global!
+
+    Keeps the presence of the connected user (see common.core.presence), clients should
+    send {"type": "heartbeat"} every few seconds while the page is open.
     """
     user_identifier = 'user_id'
+    heartbeat_type = 'heartbeat'
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         user_id = self.scope['url_route']['kwargs'][self.user_identifier]
         self.group_name = get_global_group_name(user_id)
+        self.user_id = None
 
     async def connect(self):
         await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.accept()
+        user = await get_user(self.scope)
+        if user.is_authenticated:
+            # heartbeats do not look up the user again
+            self.user_id = user.pk
+            await sync_to_async(presence.touch)(self.user_id, force=True)
+
+    async def receive_json(self, content, **kwargs):
+        if self.user_id is not None and isinstance(content, dict) and content.get('type') == self.heartbeat_type:
+            await sync_to_async(presence.touch)(self.user_id)
 
     async def send_data(self, text=None):
         user = await get_user(self.scope)
@@ -158,4 +169,7 @@ class GlobalAsyncJsonWebsocketConsumer(_AsyncJsonWebsocketConsumer):
 
     async def disconnect(self, code):
         # Called when the socket closes
+        if self.user_id is not None:
+            # last seen when leaving
+            await sync_to_async(presence.touch)(self.user_id, force=True)
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
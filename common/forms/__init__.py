@@ -1,19 +1,21 @@
 import json
 import typing
-import uuid
 from itertools import chain
 
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.db import models
-from django.db.models import Model, QuerySet
+from django.db.models import Model, QuerySet, prefetch_related_objects
+from django.db.models.fields.related_descriptors import (
+    ForwardManyToOneDescriptor, ManyToManyDescriptor, ReverseManyToOneDescriptor,
+    ReverseOneToOneDescriptor)
+from django.db.models.query import ModelIterable
 from django.forms.utils import ErrorDict, ErrorList
 from django.utils import timezone, dateparse
 from django.utils.translation import gettext
 from pytz import utc
 
-import common.models.fields as model_fields
 from common.constants import SENSITIVE_FIELDS
-from common.utils.json import CJsonEncoder
+from common.utils.json import normalize
 from common.forms.forms import *
 
 
@@ -174,9 +176,7 @@ def model_to_dict(instance, fields=None, exclude=None, many_to_many=False,
                     "may be you need 'related_sets'?" % m2m
                 )
             data[m2m] = model_to_dict(m2m_obj)
-    data = json.dumps(data, cls=CJsonEncoder)
-    data = json.loads(data)
-    return data
+    return normalize(data)
 
 
 def queryset_to_list(queryset, fields=None, exclude=None, many_to_many=False,
@@ -196,6 +196,184 @@ def queryset_to_list(queryset, fields=None, exclude=None, many_to_many=False,
     return data
 
 
+_omit = object()
+
+# django fields whose values are JSON-native already
+_PLAIN_FIELDS = (models.AutoField, models.BooleanField, models.CharField, models.FloatField,
+                 models.IntegerField, models.NullBooleanField, models.TextField)
+
+
+def _convert_datetime(value):
+    # same as model_to_dict
+    if value is None:
+        return _omit
+    if isinstance(value, str):
+        aware = utc.localize(dateparse.parse_datetime(value), is_dst=None)
+    else:
+        aware = timezone.localtime(value)
+    return aware.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _convert_date(value):
+    if value is None:
+        return _omit
+    if isinstance(value, str):
+        aware = utc.localize(dateparse.parse_date(value), is_dst=None)
+    else:
+        aware = timezone.localdate(value)
+    return aware.strftime('%Y-%m-%d')
+
+
+def _get_value_converter(f, i18n: bool):
+    """
+    Return a function converting the value of field f from values_list() to what
+    model_to_dict and CJsonEncoder produce, None if the value can be used as it is
+    """
+    if isinstance(f, models.DateTimeField):
+        return _convert_datetime
+    elif isinstance(f, models.DateField):
+        return _convert_date
+    elif isinstance(f, models.FileField):
+        storage = f.storage
+        return lambda value: storage.url(value) if value else None
+    elif i18n:
+        return lambda value: gettext(value)
+    elif isinstance(f, models.ForeignKey):
+        # attname value, i.e. the primary key of the related object
+        return _get_value_converter(f.target_field, False)
+    elif isinstance(f, _PLAIN_FIELDS) and type(f).__module__.startswith('django.'):
+        return None
+    return normalize
+
+
+class RowConverter(object):
+    """
+    Convert values_list() rows of a model to the dicts model_to_dict produces,
+    without creating model instances
+    """
+
+    def __init__(self, names: list, attnames: list, converters: list):
+        self.names = names
+        self.attnames = attnames
+        self.converters = converters
+
+    def __call__(self, row: tuple) -> dict:
+        data = dict()
+        for name, converter, value in zip(self.names, self.converters, row):
+            if converter is not None:
+                value = converter(value)
+                if value is _omit:
+                    continue
+            data[name] = value
+        return data
+
+
+_row_converters = dict()
+
+
+def get_row_converter(model, fields=None, exclude=None, i18n_fields=None,
+                      use_natural_foreign_keys=False) -> typing.Optional[RowConverter]:
+    """
+    Return the RowConverter of the model and the field set, compiled once,
+    or None if model instances are needed (generic foreign keys, natural keys)
+    """
+    fields = tuple(sorted(fields)) if fields else None
+    exclude = [exclude] if isinstance(exclude, str) else (exclude or ())
+    exclude = tuple(sorted(set(exclude) | set(SENSITIVE_FIELDS)))
+    i18n_fields = [i18n_fields] if isinstance(i18n_fields, str) else (i18n_fields or ())
+    i18n_fields = tuple(sorted(i18n_fields))
+    cache_key = (model, fields, exclude, i18n_fields, use_natural_foreign_keys)
+    if cache_key in _row_converters:
+        return _row_converters[cache_key]
+
+    converter = None
+    names, attnames, converters = list(), list(), list()
+    opts = model._meta
+    for f in chain(opts.concrete_fields, opts.private_fields):
+        if fields and f.name not in fields:
+            continue
+        if f.name in exclude:
+            continue
+        if not getattr(f, 'concrete', False):
+            # generic foreign keys and relations
+            break
+        natural_fk = isinstance(f, models.ForeignKey) and use_natural_foreign_keys
+        if natural_fk and callable(getattr(f.related_model, 'natural_key', None)):
+            break
+        names.append(f.name)
+        attnames.append(f.attname)
+        converters.append(_get_value_converter(
+            f, f.name in i18n_fields and not natural_fk and not isinstance(f, models.DateField)))
+    else:
+        converter = RowConverter(names, attnames, converters)
+    _row_converters[cache_key] = converter
+    return converter
+
+
+def values_to_list(queryset: QuerySet, fields=None, exclude=None, i18n_fields=None,
+                   **kwargs) -> typing.Optional[list]:
+    """
+    Fast path of queryset_to_list, rows are read with values_list() and converted
+    by the compiled RowConverter. Return None if model instances are needed, or the
+    queryset is evaluated already (values_list() would query again) or distinct
+    (DISTINCT would apply to the converted fields rather than whole rows).
+    """
+    if queryset._result_cache is not None or queryset.query.distinct:
+        return None
+    converter = get_row_converter(
+        queryset.model, fields=fields, exclude=exclude, i18n_fields=i18n_fields,
+        use_natural_foreign_keys=kwargs.get('use_natural_foreign_keys', False))
+    if converter is None:
+        return None
+    return [converter(row) for row in queryset.values_list(*converter.attnames)]
+
+
+def _chunked(iterable, size):
+    chunk = list()
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = list()
+    if chunk:
+        yield chunk
+
+
+def iter_serialized(queryset, chunk_size: int = 2000, fields=None, exclude=None,
+                    related_sets=None, many_to_many_fields=None, **kwargs) -> typing.Iterator[list]:
+    """
+    Serialize a large queryset chunk by chunk, rows are fetched with .iterator(chunk_size)
+    and no model instances or serialized rows of other chunks are kept, yield lists of
+    serialized rows.
+
+    Notice: only backends with server-side cursors (PostgreSQL, Oracle, SQLite) fetch
+    chunk_size rows at a time, the MySQL driver still buffers the whole result set
+    (as tuples) on the client.
+    """
+    if not isinstance(queryset, QuerySet):
+        for chunk in _chunked(queryset, chunk_size):
+            yield normalize(chunk)
+        return
+    if issubclass(queryset._iterable_class, ModelIterable):
+        if not related_sets and not many_to_many_fields and not queryset.query.distinct:
+            converter = get_row_converter(
+                queryset.model, fields=fields, exclude=exclude, i18n_fields=kwargs.get('i18n_fields'),
+                use_natural_foreign_keys=kwargs.get('use_natural_foreign_keys', False))
+            if converter is not None:
+                rows = queryset.values_list(*converter.attnames).iterator(chunk_size=chunk_size)
+                for chunk in _chunked(rows, chunk_size):
+                    yield [converter(row) for row in chunk]
+                return
+        # iterator() ignores prefetch_related, Serializer loads relations of every chunk
+        for chunk in _chunked(queryset.iterator(chunk_size=chunk_size), chunk_size):
+            yield Serializer(chunk, fields=fields, exclude=exclude, related_sets=related_sets,
+                             many_to_many_fields=many_to_many_fields, **kwargs).to_python()
+        return
+    # values(), values_list()
+    for chunk in _chunked(queryset.iterator(chunk_size=chunk_size), chunk_size):
+        yield normalize(chunk)
+
+
 class Serializer(object):
 
     def __init__(self, queryset: typing.Union[QuerySet, Model, list], fields=None, exclude=None,
@@ -210,22 +388,27 @@ class Serializer(object):
         related_sets: reversed models
         many_to_many_fields: foreign key or one to one
         """
+        if (isinstance(queryset, QuerySet) and not related_sets and not many_to_many_fields and
+                issubclass(queryset._iterable_class, ModelIterable)):
+            # no model instances are needed
+            serialized = values_to_list(queryset, fields=fields, exclude=exclude, **kwargs)
+            if serialized is not None:
+                self.sj = serialized
+                return
+
+        if related_sets or many_to_many_fields:
+            queryset = self._load_relations(queryset, related_sets, many_to_many_fields)
+
         if not queryset:
             self.sj = list()
             return
 
         # turn model instance to object list
-        is_queryset = True
-        default_exclude = SENSITIVE_FIELDS
-        if isinstance(queryset, QuerySet):
-            pk_name = queryset.model._meta.pk.attname
-        else:
-            is_queryset = False
-            if isinstance(queryset, Model):
-                pk_name = queryset._meta.pk.attname
-                queryset = [queryset]
+        if isinstance(queryset, Model):
+            queryset = [queryset]
 
         # construct and serialize
+        default_exclude = list(SENSITIVE_FIELDS)
         if exclude:
             exclude = [exclude] if isinstance(exclude, str) else list(exclude)
             default_exclude.extend(exclude)
@@ -235,116 +418,45 @@ class Serializer(object):
             related_sets=related_sets,
             fields=fields,
             exclude=default_exclude, **kwargs)
+        self.sj = serialized
 
-        # return directly for annotate operations
-        if hasattr(queryset[0], '_meta'):
-            self.sj = serialized
-            return
+    @staticmethod
+    def _load_relations(queryset, related_sets, many_to_many_fields):
+        """
+        Load the declared relations of all items at once, so that serializing them
+        takes a constant number of queries: forward foreign keys and one to one
+        fields are joined by select_related, others are prefetched
+        """
+        if isinstance(queryset, QuerySet):
+            if not issubclass(queryset._iterable_class, ModelIterable):
+                return queryset
+            model = queryset.model
+        elif isinstance(queryset, Model):
+            model = queryset._meta.model
+        elif queryset and isinstance(queryset[0], Model):
+            model = queryset[0]._meta.model
+        else:
+            return queryset
 
-        special_fields = set()
-        crypto_fields = set()
-        for qs in queryset:
-            for f in qs._meta.fields:
-                if isinstance(f, (model_fields.DictField, model_fields.ListField)):
-                    special_fields.add(f.name)
-                elif isinstance(f, model_fields.CryptoCharField):
-                    crypto_fields.add(f.name)
-
-        # serialized = json.loads(sj)
-
-        # exclude fields
-        # for item in serialized:
-        #     print(item)
-        #     print(type(item))
-        #     fields = item['fields']
-        #     fields_copy = copy.deepcopy(fields)
-        #     for k, v in fields_copy.items():
-        #         if k in default_exclude:
-        #             del fields[k]
-        for i, item in enumerate(serialized):
-            item['pk'] = queryset[i].pk
-
-        # get related-data in related_sets
-        # 反向查询
-        if related_sets:
-            for rs in related_sets:
-                if not hasattr(queryset.model, rs):
-                    raise AttributeError(rs)
-                # reversed one to one
-                if (hasattr(getattr(queryset.model, rs), 'related') and
-                        getattr(getattr(queryset.model, rs), 'related').one_to_one):
-                    for item in queryset:
-                        if hasattr(item, rs):
-                            item_set = getattr(item, rs)
-                            for s in serialized:
-                                if isinstance(item.pk, uuid.UUID):
-                                    item.pk = str(item.pk)
-                                if s['pk'] == item.pk:
-                                    s[rs] = model_to_dict(item_set)
-                                    break
-                        else:
-                            for s in serialized:
-                                if s['pk'] == item.pk:
-                                    s[rs] = None
-                                    break
-                else:
-                    for item in queryset:
-                        item_set = getattr(item, rs)
-                        qs = item_set.all()
-                        for s in serialized:
-                            if s['pk'] == item.pk:
-                                s[rs] = queryset_to_list(qs)
-                                break
-        # 正向查询
-        if many_to_many_fields:
-            for m2m in many_to_many_fields:
-                if not hasattr(queryset.model, m2m):
-                    raise AttributeError(m2m)
-                # many to many
-                if getattr(getattr(queryset.model, m2m), 'field').many_to_many:
-                    for item in queryset:
-                        qs = getattr(item, m2m).all()
-                        for s in serialized:
-                            if s['pk'] == item.pk:
-                                s[m2m] = queryset_to_list(qs)
-                                break
-                # many to one / one to one
-                elif (getattr(getattr(queryset.model, m2m), 'field').many_to_one or
-                      getattr(getattr(queryset.model, m2m), 'field').one_to_one):
-                    for item in queryset:
-                        qs = getattr(item, m2m)
-                        for s in serialized:
-                            if s['pk'] == item.pk:
-                                if qs:
-                                    s[m2m] = model_to_dict(qs)
-                                    break
-                                else:
-                                    s[m2m] = None
-                                    break
-
-        # add pk to fields, deal with other fields
-        for i, item in enumerate(serialized):
-            item[pk_name] = item['pk']
-            item['pk'] = item['pk']
-            for f in item:
-                if f in special_fields:
-                    if item[f] is None:
-                        continue
-                    # item[f] = json.loads(item[f])
-                elif f in crypto_fields:
-                    item[f] = getattr(queryset[i], f)
-
-        # if fields_only:
-        #     serialized = [item['fields'] for item in serialized]
-        #     if exclude:
-        #         if isinstance(exclude, str):
-        #             exclude = [exclude]
-        #         for s in serialized:
-        #             for e in exclude:
-        #                 if e in s:
-        #                     s.pop(e)
-
-        self.sj = serialized if is_queryset else serialized[0]
+        select, prefetch = list(), list()
+        for name in chain(related_sets or (), many_to_many_fields or ()):
+            descriptor = getattr(model, name, None)
+            if isinstance(descriptor, ForwardManyToOneDescriptor):
+                select.append(name)
+            elif isinstance(descriptor, (ReverseOneToOneDescriptor, ReverseManyToOneDescriptor,
+                                         ManyToManyDescriptor)):
+                prefetch.append(name)
+
+        if isinstance(queryset, QuerySet):
+            if select:
+                queryset = queryset.select_related(*select)
+            if prefetch:
+                queryset = queryset.prefetch_related(*prefetch)
+        elif select or prefetch:
+            # instances are loaded already
+            prefetch_related_objects(
+                [queryset] if isinstance(queryset, Model) else queryset, *(select + prefetch))
+        return queryset
 
     def to_json(self):
         return json.dumps(self.sj)
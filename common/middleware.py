@@ -20,7 +20,7 @@ from django.utils.translation import ugettext_lazy as _
 
 from common.core.exceptions import SException
 from common.log import default_logger as logger
-from common.mixin.json import ret_format, exception_to_response
+from common.mixin.json import ret_format, exception_to_response, CJsonResponse, StreamingJsonResponse
 
 
 class ExceptionProcessingMiddleware(MiddlewareMixin):
@@ -96,7 +96,7 @@ class ExceptionProcessingMiddleware(MiddlewareMixin):
                 messages = str(exception)
                 logger.error(messages)
                 logger.error(traceback.format_exc())
-            return JsonResponse(
+            return CJsonResponse(
                 ret_format(result=False, messages=messages,
                            code=code, level=level, data=data)
             )
@@ -127,13 +127,23 @@ class ExceptionProcessingMiddleware(MiddlewareMixin):
 class LoggingMiddleware(MiddlewareMixin):
 
     @staticmethod
-    def wrap_streaming_content(content):
+    def wrap_streaming_content(content, limit=1000):
+        # log the beginning of the content after it is sent, without buffering it
+        head = list()
+        size = 0
         for chunk in content:
+            if size < limit:
+                head.append(chunk[:limit - size])
+            size += len(chunk)
             yield chunk
+        log_res = b''.join(head).decode('utf-8', errors='ignore')
+        if size > limit:
+            log_res = '%s ... (%d omitted)' % (log_res, size - limit)
+        logger.debug(log_res)
 
     def _log_request_and_response(self, request, response):
         # log every request & response
-        if isinstance(response, JsonResponse):
+        if isinstance(response, (JsonResponse, StreamingJsonResponse)):
             log_req = '%(scheme)s %(method)s %(status_code)d %(path)s [%(remote_host)s:%(remote_port)s]' % (
                 {'scheme': request.scheme.upper(), 'method': request.method, 'status_code': response.status_code,
                  'path': request.path,
@@ -144,9 +154,8 @@ class LoggingMiddleware(MiddlewareMixin):
                 log_req += str(request.POST.dict())
             logger.debug(log_req)
             if response.streaming:
-                # fixme: log streaming response
-                # log_res = self.wrap_streaming_content(response.streaming_content)
-                pass
+                if settings.DEBUG:
+                    response.streaming_content = self.wrap_streaming_content(response.streaming_content)
             elif settings.DEBUG:
                 log_res = str(response.content.decode('utf-8'))
                 log_res = ('%s ... (%d omitted)' % (log_res[:1000], len(log_res) - 1000)
@@ -167,7 +176,7 @@ class CsrfViewMiddleware(_CsrfViewMiddleware):
 
     def _reject(self, request, reason):
         # response = _get_failure_view()(request, reason=reason)
-        response = JsonResponse(
+        response = CJsonResponse(
             ret_format(
                 result=False,
                 messages='CSRF validation error',
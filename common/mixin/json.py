@@ -4,16 +4,18 @@ import typing
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.db.models import QuerySet, Model
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils.functional import Promise
 from django.utils.translation import ugettext_lazy as _
 
-from common.forms import queryset_to_list, Serializer, model_to_dict
-from common.utils.json import CJsonEncoder
+from common.forms import queryset_to_list, Serializer, model_to_dict, iter_serialized
+from common.utils.json import dumps, dumps_bytes, normalize
 
 __all__ = [
     'ret_format',
     'exception_to_response',
+    'CJsonResponse',
+    'StreamingJsonResponse',
     'ResponseMixin',
     'FormValidationMixin'
 ]
@@ -76,8 +78,7 @@ def ret_format(
         elif isinstance(data, Model):
             data = model_to_dict(data, **kwargs)
         elif isinstance(data, dict):
-            data = json.dumps(data, cls=CJsonEncoder)
-            data = json.loads(data)
+            data = normalize(data)
         elif isinstance(data, list):
             if data and isinstance(data[0], Model):
                 data = Serializer(
@@ -100,7 +101,7 @@ def exception_to_response(exception, data=None, **kwargs):
     """
     if callable(exception):
         exception = exception()
-    return JsonResponse(
+    return CJsonResponse(
         ret_format(result=False,
                    messages=kwargs.get('messages') or str(exception),
                    level=kwargs.get('level') or exception.level,
@@ -109,6 +110,28 @@ def exception_to_response(exception, data=None, **kwargs):
     )
 
 
+class CJsonResponse(JsonResponse):
+    """
+    JsonResponse encoded by the configured encoder backend (see common.utils.json.get_backend)
+    """
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                'In order to allow non-dict objects to be serialized set the '
+                'safe parameter to False.'
+            )
+        kwargs.setdefault('content_type', 'application/json')
+        HttpResponse.__init__(self, content=dumps_bytes(data), **kwargs)
+
+
+class StreamingJsonResponse(StreamingHttpResponse):
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(*args, **kwargs)
+
+
 class ResponseMixin:
     """
     A mixin that can be used to render a JSON response.
@@ -138,16 +161,53 @@ class ResponseMixin:
             # for paged list
             _data = res_data['data']
             res_data['data'] = dict(objects=_data, total_length=self.total_length)
+            if getattr(self, 'cursors', None) is not None:
+                # cursor pagination, see AdvancedListView.cursor_pagination
+                res_data['data'].update(self.cursors)
+            if hasattr(self, 'exact_count'):
+                # see AdvancedListView.count_strategy
+                res_data['data']['exact_count'] = self.exact_count
         if 'total_length' in res_data['data'] and res_data['data']['total_length'] is None:
             res_data['data']['total_length'] = len(res_data['data']['objects'])
-        response = JsonResponse(
+        response = CJsonResponse(
             res_data,
-            encoder=CJsonEncoder,
             **response_kwargs
         )
 
         return response
 
+    def render_to_streaming_json_response(self, data, chunk_size: int = 2000, result: bool = True,
+                                          messages=None, level=None, code=200, default_msg=True,
+                                          **response_kwargs):
+        """
+        Returns a streaming JSON response of a large queryset (or iterable), the payload
+        is the same as render_to_json_response's with a list as data. Rows are fetched
+        with .iterator(chunk_size) and serialized chunk by chunk, so neither model
+        instances nor the serialized payload are held in memory at once. On MySQL the
+        raw result set is still buffered by the driver, see iter_serialized.
+        """
+        envelope = ret_format(result=result, messages=messages, level=level, code=code,
+                              default_msg=default_msg)
+        envelope.pop('data')
+        return StreamingJsonResponse(
+            self._iter_json(envelope, data, chunk_size), **response_kwargs)
+
+    def _iter_json(self, envelope, data, chunk_size):
+        # open the envelope, then write rows into its data
+        head = dumps(envelope)
+        yield head[:-1] + ', "data": ['
+        first = True
+        for chunk in iter_serialized(
+                data, chunk_size=chunk_size, use_natural_foreign_keys=True,
+                related_sets=getattr(self, 'related_sets', None),
+                many_to_many_fields=getattr(self, 'many_to_many_fields', None)):
+            if not chunk:
+                continue
+            body = ', '.join(dumps(row) for row in chunk)
+            yield body if first else ', ' + body
+            first = False
+        yield ']}'
+
     def _get_ret_form_data(self, **kwargs):
         """
         Returns an object that will be serialized as JSON by json.dumps().
@@ -164,7 +224,7 @@ class ResponseMixin:
         if kwargs.get('perms', True):
             for row in data['data']:
                 row['perms'] = list(self.request.user.get_all_permissions())
-        return JsonResponse(data, encoder=CJsonEncoder)
+        return CJsonResponse(data)
 
     @staticmethod
     def model_object_to_dict(obj):
@@ -1,10 +1,26 @@
-from django.core.paginator import Paginator, Page as _Page
+import datetime
+import decimal
+import typing
+import uuid
+
+from bson import ObjectId
+from django.core import signing
+from django.core.paginator import EmptyPage, Paginator, Page as _Page
+from django.db.models import Q
 from django.utils.functional import cached_property
+from pymongo import ASCENDING, DESCENDING
 from pymongo.cursor import Cursor
 
+from common.core.exceptions import InvalidParameter
+
 __all__ = [
     'Paginator',
-    'MongoPaginator'
+    'MongoPaginator',
+    'InexactCountPaginator',
+    'InexactCountMongoPaginator',
+    'CursorPage',
+    'CursorPaginator',
+    'MongoCursorPaginator',
 ]
 
 
@@ -58,3 +74,196 @@ class MongoPaginator(Paginator):
         standard :cls:`Page` object.
         """
         return MongoPage(*args, **kwargs)
+
+
+class InexactCountMixin:
+    """
+    The count of the paginator may be an estimate or outdated (see
+    AdvancedListView.count_strategy), page numbers beyond it are accepted when
+    exact_count is False, so that rows a low count misses are still reachable
+    """
+    exact_count = True
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if self.exact_count or int(number) < 1:
+                raise
+            return int(number)
+
+
+class InexactCountPaginator(InexactCountMixin, Paginator):
+
+    def page(self, number):
+        if self.exact_count:
+            return super().page(number)
+        # slice by the page number only, the count does not bound the last page
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+class InexactCountMongoPaginator(InexactCountMixin, MongoPaginator):
+    pass
+
+
+class CursorPage(object):
+
+    def __init__(self, object_list: list, next_cursor: str = None, prev_cursor: str = None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+
+def _dump_value(value):
+    # values in cursors are dumped as JSON, keep their types
+    if isinstance(value, datetime.datetime):
+        return ['dt', value.isoformat()]
+    elif isinstance(value, datetime.date):
+        return ['d', value.isoformat()]
+    elif isinstance(value, ObjectId):
+        return ['oid', str(value)]
+    elif isinstance(value, (uuid.UUID, decimal.Decimal)):
+        return ['s', str(value)]
+    return ['v', value]
+
+
+def _load_value(item):
+    kind, value = item
+    if kind == 'dt':
+        return datetime.datetime.fromisoformat(value)
+    elif kind == 'd':
+        return datetime.date.fromisoformat(value)
+    elif kind == 'oid':
+        return ObjectId(value)
+    return value
+
+
+class CursorPaginator(object):
+    """
+    Keyset (seek) pagination of a QuerySet
+
+    A page is located by the values of the ordering field and the primary key of the
+    last (or first) item of its previous (or next) page instead of OFFSET, so that deep
+    pages cost the same as the first one. The ordering field should be a non-null
+    field of the model itself, e.g. 'created_at' or '-id'.
+
+    Cursors are opaque signed tokens, page(None) returns the first page.
+    """
+    pk_name = 'pk'
+    salt = 'common.paginator.CursorPaginator'
+
+    def __init__(self, object_list, per_page: int, ordering: str = None):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        ordering = ordering or self.pk_name
+        self.descending = ordering.startswith('-')
+        self.field = ordering.lstrip('-')
+
+    def _is_pk(self, name) -> bool:
+        meta = self.object_list.model._meta
+        return name in (self.pk_name, meta.pk.name, meta.pk.attname)
+
+    def _get_value(self, item, name):
+        if isinstance(item, dict):
+            # values()
+            if self._is_pk(name):
+                name = self.object_list.model._meta.pk.attname
+            return item[name]
+        return getattr(item, name)
+
+    def _fetch(self, values, descending: bool, limit: int) -> list:
+        queryset = self.object_list
+        lookup = 'lt' if descending else 'gt'
+        prefix = '-' if descending else ''
+        if values is not None:
+            value, pk = values
+            if self._is_pk(self.field):
+                queryset = queryset.filter(**{'pk__' + lookup: pk})
+            else:
+                queryset = queryset.filter(
+                    Q(**{'%s__%s' % (self.field, lookup): value}) |
+                    Q(**{self.field: value, 'pk__' + lookup: pk}))
+        if self._is_pk(self.field):
+            queryset = queryset.order_by(prefix + 'pk')
+        else:
+            queryset = queryset.order_by(prefix + self.field, prefix + 'pk')
+        return list(queryset[:limit])
+
+    def encode_cursor(self, item, backwards: bool) -> str:
+        values = [self._get_value(item, self.field), self._get_value(item, self.pk_name)]
+        return signing.dumps([backwards, [_dump_value(v) for v in values]], salt=self.salt)
+
+    def decode_cursor(self, cursor: str) -> typing.Tuple[bool, list]:
+        try:
+            backwards, values = signing.loads(cursor, salt=self.salt)
+            return bool(backwards), [_load_value(v) for v in values]
+        except (signing.BadSignature, TypeError, ValueError):
+            raise InvalidParameter(param='cursor')
+
+    def page(self, cursor: str = None) -> CursorPage:
+        backwards, values = self.decode_cursor(cursor) if cursor else (False, None)
+        # going backwards seeks in the reversed order
+        items = self._fetch(values, self.descending != backwards, self.per_page + 1)
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if not items:
+            return CursorPage(items)
+        if backwards:
+            items.reverse()
+            next_cursor = self.encode_cursor(items[-1], False)
+            prev_cursor = self.encode_cursor(items[0], True) if has_more else None
+        else:
+            next_cursor = self.encode_cursor(items[-1], False) if has_more else None
+            prev_cursor = self.encode_cursor(items[0], True) if cursor else None
+        return CursorPage(items, next_cursor, prev_cursor)
+
+    @cached_property
+    def count(self):
+        return self.object_list.count()
+
+
+class MongoCursorPaginator(CursorPaginator):
+    """
+    Keyset pagination of a Mongo collection, ordered by the given field and _id
+    """
+    pk_name = '_id'
+    salt = 'common.paginator.MongoCursorPaginator'
+
+    def __init__(self, collection, per_page: int, ordering: str = None, filter: dict = None):
+        super().__init__(collection, per_page, ordering=ordering)
+        self.filter = filter or dict()
+
+    def _is_pk(self, name):
+        return name == self.pk_name
+
+    def _get_value(self, item, name):
+        return item.get(name)
+
+    def _fetch(self, values, descending, limit):
+        op = '$lt' if descending else '$gt'
+        direction = DESCENDING if descending else ASCENDING
+        conditions = self.filter
+        if values is not None:
+            value, pk = values
+            if self._is_pk(self.field):
+                seek = {self.pk_name: {op: pk}}
+            else:
+                seek = {'$or': [{self.field: {op: value}},
+                                {self.field: value, self.pk_name: {op: pk}}]}
+            conditions = {'$and': [conditions, seek]} if conditions else seek
+        sort = [(self.pk_name, direction)]
+        if not self._is_pk(self.field):
+            sort.insert(0, (self.field, direction))
+        return list(self.object_list.find(conditions).sort(sort).limit(limit))
+
+    @cached_property
+    def count(self):
+        return self.object_list.count_documents(self.filter)
@@ -1,49 +1,262 @@
 import decimal
 import json
+import math
+import typing
 import uuid
 from datetime import datetime, date, time
 
 import IPy
 import bson
+from django.conf import settings
 from django.db.models.fields.files import FieldFile
 from django.utils import timezone
 from django.utils.functional import Promise
+from django.utils.module_loading import import_string
 from django.forms import model_to_dict
 from django.db.models import Model
 from django.utils.timezone import get_current_timezone
 
 from common.constants import SENSITIVE_FIELDS
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 __all__ = [
     'CJsonEncoder',
+    'register_type',
+    'encode_default',
+    'BaseJsonBackend',
+    'StdlibJsonBackend',
+    'OrJsonBackend',
+    'get_backend',
+    'dumps',
+    'dumps_bytes',
     'is_json_str',
+    'normalize',
 ]
 
 
+def _encode_datetime(obj):
+    return timezone.localtime(obj).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _encode_date(obj):
+    obj = datetime(obj.year, obj.month, obj.day, 0, 0, 0, tzinfo=get_current_timezone())
+    return timezone.localdate(obj).strftime('%Y-%m-%d')
+
+
+def _encode_time(obj):
+    return obj.strftime('%H:%M:%S')
+
+
+def _encode_ip_set(obj):
+    return list(map(lambda x: str(x), obj))
+
+
+def _encode_none(obj):
+    return
+
+
+def _encode_field_file(obj):
+    if obj:
+        return obj.url
+
+
+def _encode_model(obj):
+    return model_to_dict(obj, exclude=SENSITIVE_FIELDS)
+
+
+# {type: handler}, handlers of subclasses are looked up along their MRO
+_type_handlers = {
+    datetime: _encode_datetime,
+    date: _encode_date,
+    time: _encode_time,
+    bson.ObjectId: str,
+    decimal.Decimal: str,
+    uuid.UUID: str,
+    Promise: str,
+    IPy.IP: str,
+    IPy.IPSet: _encode_ip_set,
+    FieldFile: _encode_field_file,
+    Model: _encode_model,
+}
+# {class: handler or None}, resolved classes
+_resolved_handlers = dict()
+
+
+def register_type(type_, handler: typing.Callable):
+    """
+    Register handler(obj) which turns objects of type_ (and its subclasses) into
+    JSON-native values, for all encoder backends
+    """
+    _type_handlers[type_] = handler
+    _resolved_handlers.clear()
+
+
+def _resolve_handler(cls):
+    for base in cls.__mro__:
+        handler = _type_handlers.get(base)
+        if handler is not None:
+            break
+    else:
+        # managers of generic relations are created dynamically
+        handler = _encode_none if cls.__name__ == 'GenericRelatedObjectManager' else None
+    _resolved_handlers[cls] = handler
+    return handler
+
+
+def encode_default(obj):
+    """
+    Turn an object that JSON does not support into a JSON-native value, raise TypeError
+    for unknown types
+    """
+    cls = obj.__class__
+    try:
+        handler = _resolved_handlers[cls]
+    except KeyError:
+        handler = _resolve_handler(cls)
+    if handler is None:
+        raise TypeError('Object of type %s is not JSON serializable' % cls.__name__)
+    return handler(obj)
+
+
 class CJsonEncoder(json.JSONEncoder):
-    objects_to_string = (bson.ObjectId, decimal.Decimal, uuid.UUID, Promise, IPy.IP)
 
     def default(self, obj):
-        if isinstance(obj, datetime):
-            return timezone.localtime(obj).strftime('%Y-%m-%d %H:%M:%S')
-        elif isinstance(obj, date):
-            obj = datetime(obj.year, obj.month, obj.day, 0, 0, 0, tzinfo=get_current_timezone())
-            return timezone.localdate(obj).strftime('%Y-%m-%d')
-        elif isinstance(obj, time):
-            return obj.strftime('%H:%M:%S')
-        elif isinstance(obj, self.objects_to_string):
-            return str(obj)
-        elif isinstance(obj, IPy.IPSet):
-            return list(map(lambda x: str(x), obj))
-        elif obj.__class__.__name__ == 'GenericRelatedObjectManager':
-            return
-        elif isinstance(obj, FieldFile):
-            if obj:
-                return obj.url
-        elif isinstance(obj, Model):
-            return model_to_dict(obj, exclude=SENSITIVE_FIELDS)
+        return encode_default(obj)
+
+
+class BaseJsonBackend(object):
+    """
+    Encode objects to JSON for HTTP responses and websocket frames, types JSON does not
+    support are handled by encode_default. Values stored in the database are encoded by
+    CJsonEncoder, so that their text does not depend on the backend.
+    """
+    name = None
+
+    def dumps(self, obj) -> str:
+        raise NotImplementedError
+
+    def dumps_bytes(self, obj) -> bytes:
+        return self.dumps(obj).encode('utf-8')
+
+
+def _finite(obj):
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    elif isinstance(obj, dict):
+        return {k: _finite(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [_finite(v) for v in obj]
+    return obj
+
+
+class StdlibJsonBackend(BaseJsonBackend):
+    """
+    NaN and Infinity, which are not valid JSON, are encoded as null like orjson does
+    """
+    name = 'json'
+
+    def dumps(self, obj):
+        try:
+            return json.dumps(obj, cls=CJsonEncoder, allow_nan=False)
+        except ValueError:
+            return json.dumps(_finite(normalize(obj)), cls=CJsonEncoder)
+
+
+class OrJsonBackend(StdlibJsonBackend):
+    """
+    Output is compact and not ASCII-escaped. Integers beyond 64 bits, which orjson
+    does not support, fall back to the standard library.
+    """
+    name = 'orjson'
+    option = 0 if orjson is None else orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj):
+        return self.dumps_bytes(obj).decode('utf-8')
+
+    def dumps_bytes(self, obj):
+        try:
+            return orjson.dumps(obj, default=encode_default, option=self.option)
+        except orjson.JSONEncodeError:
+            return super().dumps(obj).encode('utf-8')
+
+
+_backend = None
+
+
+def get_backend() -> BaseJsonBackend:
+    """
+    settings.JSON_ENCODER_BACKEND is the dotted path of a backend class, defaults to
+    orjson if it is installed, otherwise the standard library
+    """
+    global _backend
+    if _backend is None:
+        backend_path = getattr(settings, 'JSON_ENCODER_BACKEND', None)
+        if backend_path is not None:
+            _backend = import_string(backend_path)()
+        elif orjson is not None:
+            _backend = OrJsonBackend()
         else:
-            return json.JSONEncoder.default(self, obj)
+            _backend = StdlibJsonBackend()
+    return _backend
+
+
+def dumps(obj) -> str:
+    return get_backend().dumps(obj)
+
+
+def dumps_bytes(obj) -> bytes:
+    return get_backend().dumps_bytes(obj)
+
+
+_native_types = (str, int, float, bool, type(None))
+
+
+def _normalize_key(key):
+    # the same as json.dumps does with keys
+    if isinstance(key, str):
+        return key
+    elif key is True:
+        return 'true'
+    elif key is False:
+        return 'false'
+    elif key is None:
+        return 'null'
+    elif isinstance(key, int):
+        return int.__repr__(key)
+    elif isinstance(key, float):
+        if key != key:
+            return 'NaN'
+        elif key in (float('inf'), float('-inf')):
+            return 'Infinity' if key > 0 else '-Infinity'
+        return float.__repr__(key)
+    raise TypeError('keys must be str, int, float, bool or None, not %s' % key.__class__.__name__)
+
+
+def normalize(obj):
+    """
+    Turn obj into JSON-native values (dict, list, str, int, float, bool and None) in
+    one pass, the same as json.loads(json.dumps(obj, cls=CJsonEncoder)) but without
+    producing intermediate strings
+    """
+    if type(obj) in _native_types:
+        return obj
+    elif isinstance(obj, dict):
+        return {_normalize_key(k): normalize(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [normalize(v) for v in obj]
+    elif isinstance(obj, str):
+        return str.__str__(obj)
+    elif isinstance(obj, bool):
+        return bool(obj)
+    elif isinstance(obj, int):
+        return int(obj)
+    elif isinstance(obj, float):
+        return float(obj)
+    return normalize(encode_default(obj))
 
 
 def is_json_str(raw_str):
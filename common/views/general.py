@@ -1,27 +1,36 @@
 import datetime
+import hashlib
 import typing
+from functools import partial
 from itertools import chain
 
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.core.paginator import Paginator
-from django.db import models
+from django.db import connection, connections, models
 from django.db.models.query import QuerySet
 from django.http.request import QueryDict
 from django.http.response import (
     Http404
 )
+from django.utils.http import urlencode
 from django.utils.translation import ugettext_lazy as _
 from django.views.generic import (
     ListView as _ListView, DetailView as _DetailView, DeleteView as _DeleteView,
     CreateView as _CreateView, UpdateView as _UpdateView, View as _View,
     FormView as _FormView, TemplateView as _TemplateView)
+from pymongo.cursor import Cursor
 
 from common.core.db import MongoDB
 from common.core.exceptions import InvalidParameter
 from common.forms import queryset_to_list
+from common.log import default_logger as logger
 from common.mixin import ResponseMixin, FormValidationMixin
 from common.mixin.general import BaseViewMixin
-from common.paginator import MongoPaginator
+from common.paginator import (
+    MongoPaginator, CursorPaginator, MongoCursorPaginator, InexactCountPaginator,
+    InexactCountMongoPaginator)
 from common.utils.datetime import to_aware_datetime
 from common.utils.text import str2iter, str2bool, str2int, str2float
 
@@ -30,6 +39,10 @@ __all__ = [
     'ListView', 'CreateView', 'DetailView', 'UpdateView', 'DeleteView'
 ]
 
+COUNT_EXACT = 'exact'
+COUNT_CACHED = 'cached'
+COUNT_ESTIMATED = 'estimated'
+
 
 class View(BaseViewMixin, ResponseMixin, _View):
 
@@ -75,6 +88,36 @@ class AdvancedListView(ListView):
     collection = None
     show_all = False
     total_length = None
+    # 为True时先在数据库中分页（COUNT + LIMIT/OFFSET），handle_queryset只处理当前页的数据，
+    # 此时handle_queryset收到的是已切片的queryset，不能再filter、order_by等
+    paginate_in_database = False
+    # 为True时使用游标（keyset）分页，按orderBy字段和主键定位，深页与第一页的开销相同，
+    # URL参数cursor为上一次返回的next或prev，返回值中包含next和prev
+    cursor_pagination = False
+    cursor_kwarg = 'cursor'
+    cursors = None
+    # Mongo的过滤条件，用于游标分页
+    mongo_filter = None
+    # total_length的计算方式：
+    # exact: COUNT(*)
+    # cached: COUNT(*)的结果按用户和过滤参数缓存count_cache_timeout秒
+    # estimated: 估算值，MySQL取EXPLAIN的rows（无过滤条件时取information_schema.TABLES），
+    # Mongo无过滤条件时取estimated_document_count，不支持估算时仍为精确值
+    # 返回值中exact_count表示total_length是否为精确值，计数不精确时页码不受total_length限制
+    count_strategy = COUNT_EXACT
+    count_cache_timeout = 60
+    exact_count = True
+    # 允许过滤的字段（attname），None表示所有字段
+    filter_fields: tuple = None
+    # 为True时仅允许过滤有索引的字段（主键、唯一、db_index、外键和多对多）
+    filter_indexed_only = False
+    # 为True时all=true的请求以流的形式返回，数据分块查询和序列化，不会保存所有模型实例和序列化结果
+    # （MySQL驱动仍会在客户端缓存整个结果集）
+    stream_all = False
+    stream_chunk_size = 2000
+    # DEBUG模式下在响应头X-Query-Count中返回本次请求（不含中间件）的数据库查询数，
+    # 超过max_queries时记录警告
+    max_queries: int = None
 
     def __init__(self):
         self.object_list = None
@@ -92,6 +135,28 @@ class AdvancedListView(ListView):
         if cls.many_to_many_fields and not isinstance(cls.many_to_many_fields, tuple):
             raise AttributeError('\'many_to_many_fields\' must be a tuple.')
 
+    def get(self, request, *args, **kwargs):
+        if not settings.DEBUG:
+            return self._get(request, *args, **kwargs)
+        # connection.queries is recorded under DEBUG, rows of streaming responses are
+        # fetched after returning, they are not counted
+        start = len(connection.queries)
+        response = self._get(request, *args, **kwargs)
+        queries = connection.queries[start:]
+        response['X-Query-Count'] = len(queries)
+        if self.max_queries is not None and len(queries) > self.max_queries:
+            logger.warning('%s ran %d queries, more than %d: %s' % (
+                self.__class__.__name__, len(queries), self.max_queries,
+                '; '.join(q['sql'] for q in queries)))
+        return response
+
+    def _get(self, request, *args, **kwargs):
+        self.object_list = self.get_object_list(**kwargs)
+        if self.stream_all and self.show_all and isinstance(self.object_list, QuerySet):
+            return self.render_to_streaming_json_response(
+                self.object_list, chunk_size=self.stream_chunk_size)
+        return self.render_to_json_response(data=self.object_list)
+
     def get_object_list(self, **kwargs):
         """
         Paginate the queryset and return paged list of items
@@ -101,12 +166,17 @@ class AdvancedListView(ListView):
         queryset = self.before_filter_queryset(queryset, **kwargs)
         queryset = self._filter_queryset(queryset)
 
+        page_size = self.get_page_size()
+        if self.cursor_pagination and page_size and not self.get_show_all():
+            return self._get_cursor_paged_list(queryset, page_size, **kwargs)
+        if (self.paginate_in_database and isinstance(queryset, QuerySet) and
+                page_size and not self.get_show_all()):
+            return self._get_database_paged_list(queryset, page_size, **kwargs)
+
         # custom queryset handler
         queryset = self.handle_queryset(queryset, **kwargs)
-        self.total_length = len(queryset)
 
         # pagination
-        page_size = self.get_page_size()
         if page_size and not self.get_show_all():
             try:
                 paginator, page, self.object_list, has_another_page = self.paginate_queryset(
@@ -116,6 +186,8 @@ class AdvancedListView(ListView):
                 return list()
             self.paginator = paginator
             self.page = page
+            # the only count of the request, free for lists and evaluated querysets
+            self.total_length = paginator.count
         else:
             self.object_list = queryset
         if self.paginator_class is MongoPaginator:
@@ -123,6 +195,123 @@ class AdvancedListView(ListView):
             self.object_list = list(self.object_list)
         return self.object_list
 
+    def _get_database_paged_list(self, queryset, page_size, **kwargs):
+        """
+        Slice the queryset at the database and only handle the current page
+        """
+        try:
+            paginator, page, object_list, has_another_page = self.paginate_queryset(
+                queryset, page_size)
+        except Http404:
+            # this is for frontend pagination
+            return list()
+        self.paginator = paginator
+        self.page = page
+        # SELECT COUNT(*), made by the paginator
+        self.total_length = paginator.count
+        self.object_list = self.handle_queryset(object_list, **kwargs)
+        return self.object_list
+
+    def _get_cursor_paged_list(self, queryset, page_size, **kwargs):
+        """
+        Seek the current page by the cursor, handle_queryset receives a list
+        """
+        ordering = self.get_ordering()
+        if isinstance(ordering, (list, tuple)):
+            ordering = ordering[0] if ordering else None
+        if self.paginator_class is MongoPaginator:
+            collection = queryset.collection if isinstance(queryset, Cursor) else queryset
+            paginator = MongoCursorPaginator(collection, page_size, ordering, filter=self.mongo_filter)
+        else:
+            paginator = CursorPaginator(queryset, page_size, ordering)
+        page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        self.paginator = paginator
+        self.page = page
+        self.cursors = {'next': page.next_cursor, 'prev': page.prev_cursor}
+        if self.count_strategy != COUNT_EXACT:
+            paginator.count = self.get_total_count(queryset)
+        self.total_length = paginator.count
+        self.object_list = self.handle_queryset(page.object_list, **kwargs)
+        return self.object_list
+
+    def get_paginator(self, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True, **kwargs):
+        if self.count_strategy == COUNT_EXACT or not isinstance(queryset, (QuerySet, Cursor)):
+            return super().get_paginator(
+                queryset, per_page, orphans=orphans,
+                allow_empty_first_page=allow_empty_first_page, **kwargs)
+        # pages are validated against the data rather than a count which may be inexact
+        paginator_class = (InexactCountMongoPaginator if self.paginator_class is MongoPaginator
+                           else InexactCountPaginator)
+        paginator = paginator_class(
+            queryset, per_page, orphans=orphans,
+            allow_empty_first_page=allow_empty_first_page, **kwargs)
+        # Paginator.count is a cached_property
+        paginator.count = self.get_total_count(queryset)
+        paginator.exact_count = self.exact_count
+        return paginator
+
+    def _get_count_cache_key(self) -> str:
+        # pagination and ordering do not change the count, the user may (see before_filter_queryset)
+        ignored = (self.page_kwarg, 'pageSize', 'orderBy', 'all', self.cursor_kwarg)
+        params = sorted((k, v) for k, v in self.request.GET.lists() if k not in ignored)
+        digest = hashlib.md5(urlencode(params, doseq=True).encode()).hexdigest()
+        return 'list_count_%s_%s_%s_%s' % (
+            self.__class__.__module__, self.__class__.__name__, self.request.user.pk, digest)
+
+    def _count_exactly(self, queryset) -> int:
+        if isinstance(queryset, QuerySet):
+            return queryset.count()
+        collection = queryset.collection if isinstance(queryset, Cursor) else queryset
+        return collection.count_documents(self.mongo_filter or dict())
+
+    def _estimate_count(self, queryset) -> typing.Optional[int]:
+        """
+        Return the estimated count, or None if it can not be estimated
+        """
+        if isinstance(queryset, QuerySet):
+            conn = connections[queryset.db]
+            if conn.vendor != 'mysql':
+                return None
+            with conn.cursor() as cursor:
+                if not queryset.query.where:
+                    cursor.execute(
+                        'SELECT TABLE_ROWS FROM information_schema.TABLES '
+                        'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                        [queryset.model._meta.db_table])
+                    row = cursor.fetchone()
+                    return row[0] if row and row[0] is not None else None
+                sql, params = queryset.order_by().query.sql_with_params()
+                cursor.execute('EXPLAIN ' + sql, params)
+                columns = [col[0] for col in cursor.description]
+                row = cursor.fetchone()
+                # rows examined of the driving table
+                return row[columns.index('rows')] if row else None
+        if self.mongo_filter:
+            return None
+        collection = queryset.collection if isinstance(queryset, Cursor) else queryset
+        return collection.estimated_document_count()
+
+    def get_total_count(self, queryset) -> int:
+        """
+        Count the queryset (or Mongo cursor) by count_strategy
+        """
+        if self.count_strategy == COUNT_ESTIMATED:
+            count = self._estimate_count(queryset)
+            if count is not None:
+                self.exact_count = False
+                return count
+        elif self.count_strategy == COUNT_CACHED:
+            key = self._get_count_cache_key()
+            count = cache.get(key)
+            if count is not None:
+                self.exact_count = False
+                return count
+            count = self._count_exactly(queryset)
+            cache.set(key, count, self.count_cache_timeout)
+            return count
+        return self._count_exactly(queryset)
+
     def handle_queryset(self, queryset, **kwargs) -> typing.Union[QuerySet, list]:
         """
         Write your logic here, e.g. process queryset again.
@@ -239,6 +428,58 @@ class AdvancedListView(ListView):
         def exclude(self, cond):
             return self.exc + cond
 
+    @classmethod
+    def _clean_range_value(cls, value, field=None):
+        value = cls._clean_query_value(value, field, iterable=True)
+        if isinstance(value, str) or len(value) != 2:
+            raise InvalidParameter(
+                _('Range must be a list with two elements.'))
+        return value
+
+    @staticmethod
+    def _clean_isnull_value(value):
+        try:
+            return str2bool(value)
+        except (TypeError, ValueError):
+            raise InvalidParameter(
+                _('isnull accepts only bool type'))
+
+    @classmethod
+    def _compile_filter_schema(cls, model) -> dict:
+        meta = model._meta
+        schema = dict()
+        for f in chain(meta.concrete_fields, meta.many_to_many):
+            name = f.attname
+            if cls.filter_fields is not None and name not in cls.filter_fields:
+                continue
+            if cls.filter_indexed_only and not (
+                    f.primary_key or f.unique or f.db_index or f.many_to_many):
+                continue
+            ff = cls.FilterFormat(name)
+            coercer = partial(cls._clean_query_value, field=f)
+            schema[ff.isin] = (False, ff.isin, partial(cls._clean_query_value, field=f, iterable=True))
+            schema[ff.range] = (False, ff.range, partial(cls._clean_range_value, field=f))
+            schema[ff.isnull] = (False, ff.isnull, cls._clean_isnull_value)
+            for item in (ff.exact, ff.iexact, ff.contains, ff.icontains,
+                         ff.gt, ff.gte, ff.lt, ff.lte):
+                schema[item] = (False, item, coercer)
+                schema[ff.exclude(item)] = (True, item, coercer)
+        return schema
+
+    @classmethod
+    def get_filter_schema(cls, model) -> typing.Dict[str, typing.Tuple[bool, str, typing.Callable]]:
+        """
+        Return {query parameter: (exclude, lookup, coercer)} of the model,
+        compiled once per view class
+        """
+        # not inherited, subclasses may filter different fields
+        schemas = cls.__dict__.get('_filter_schemas')
+        if schemas is None:
+            schemas = cls._filter_schemas = dict()
+        if model not in schemas:
+            schemas[model] = cls._compile_filter_schema(model)
+        return schemas[model]
+
     def _filter_queryset(self, queryset):
         """
         Filter queryset by layer, then by filter parameters and
@@ -247,109 +488,83 @@ class AdvancedListView(ListView):
 
         # filtering except in case of passing parameter all=true
         query_data = self.request.GET
-        if queryset.exists():
-            ordering = self.get_ordering()
-            if self.paginator_class is Paginator:
-                meta = queryset[0]._meta
-                fields = chain(meta.concrete_fields, meta.many_to_many)
-                # try to get filters
-                conditions = dict()
-                exclude_cond = dict()
-                for i, f in enumerate(fields):
-                    name = f.attname
+        ordering = self.get_ordering()
+        if self.paginator_class is Paginator and isinstance(queryset, QuerySet):
+            schema = self.get_filter_schema(queryset.model)
+            # try to get filters, only parameters present are looked at
+            conditions = dict()
+            exclude_cond = dict()
+            for param, value in query_data.items():
+                if not value or param not in schema:
+                    continue
+                exclude, lookup, coercer = schema[param]
+                if not exclude:
+                    conditions[lookup] = coercer(value)
+                elif not query_data.get(lookup):
+                    # filtering wins if both are present
+                    exclude_cond[lookup] = coercer(value)
+            queryset = queryset.exclude(**exclude_cond).filter(**conditions)
+
+            if ordering:
+                if isinstance(ordering, str):
+                    ordering = (ordering,)
+                queryset = queryset.order_by(*ordering)
+
+        elif self.paginator_class is MongoPaginator:
+            conditions = dict()
+            # col = getattr(self, 'collection')
+            first_item = queryset.find_one()
+            if first_item:
+                for name, v in first_item.items():
                     ff = self.FilterFormat(name)
                     if query_data.get(ff.isin):
-                        conditions[ff.isin] = self._clean_query_value(
-                            query_data.get(ff.isin), f, iterable=True)
-                    if query_data.get(ff.range):
                         value = self._clean_query_value(
-                            query_data.get(ff.range), f, iterable=True)
+                            query_data.get(ff.isin), refer_value=v,
+                            iterable=True)
+                        conditions[name] = {'$in': value}
+                    elif query_data.get(ff.range):
+                        value = self._clean_query_value(
+                            query_data.get(ff.range), refer_value=v,
+                            iterable=True)
                         if isinstance(value, str) or len(value) != 2:
                             raise InvalidParameter(
                                 _('Range must be a list with two elements.'))
-                        conditions[ff.range] = value
-
-                    if query_data.get(ff.isnull):
-                        try:
-                            cleaned_value = str2bool(query_data.get(ff.isnull))
-                        except (TypeError, ValueError):
-                            raise InvalidParameter(
-                                _('isnull accepts only bool type'))
-                        conditions[ff.isnull] = cleaned_value
-
-                    common_cond = (
-                        ff.exact, ff.iexact, ff.contains, ff.icontains,
-                        ff.gt, ff.gte, ff.lt, ff.lte)
-                    for item in common_cond:
+                        _cond = {'$gte': value[0], '$lte': value[1]}
+                        conditions.update({name: _cond})
+                    elif query_data.get(ff.isnull):
+                        value = str2bool(query_data.get(ff.isnull))
+                        conditions.update({name: value})
+                    for item in (ff.exact, ff.gt, ff.gte, ff.lt, ff.lte, ff.contains):
                         if query_data.get(item):
-                            conditions[item] = self._clean_query_value(
-                                query_data.get(item), f)
-                        elif query_data.get(ff.exclude(item)):
-                            exclude_cond[item] = self._clean_query_value(
-                                query_data.get(ff.exclude(item)), f)
-                queryset = queryset.exclude(**exclude_cond).filter(**conditions)
-
-                if ordering:
-                    if isinstance(ordering, str):
-                        ordering = (ordering,)
-                    queryset = queryset.order_by(*ordering)
-
-                self.total_length = queryset.count()
-
-            elif self.paginator_class is MongoPaginator:
-                conditions = dict()
-                # col = getattr(self, 'collection')
-                first_item = queryset.find_one()
-                if first_item:
-                    for name, v in first_item.items():
-                        ff = self.FilterFormat(name)
-                        if query_data.get(ff.isin):
                             value = self._clean_query_value(
-                                query_data.get(ff.isin), refer_value=v,
-                                iterable=True)
-                            conditions[name] = {'$in': value}
-                        elif query_data.get(ff.range):
-                            value = self._clean_query_value(
-                                query_data.get(ff.range), refer_value=v,
-                                iterable=True)
-                            if isinstance(value, str) or len(value) != 2:
-                                raise InvalidParameter(
-                                    _('Range must be a list with two elements.'))
-                            _cond = {'$gte': value[0], '$lte': value[1]}
-                            conditions.update({name: _cond})
-                        elif query_data.get(ff.isnull):
-                            value = str2bool(query_data.get(ff.isnull))
-                            conditions.update({name: value})
-                        for item in (ff.exact, ff.gt, ff.gte, ff.lt, ff.lte, ff.contains):
-                            if query_data.get(item):
-                                value = self._clean_query_value(
-                                    query_data.get(item), refer_value=v)
-                                if item == ff.exact:
-                                    conditions.update({name: value})
-                                else:
-                                    _cond = dict()
-                                    if item == ff.gt:
-                                        _cond.update({'$gt': value})
-                                    elif item == ff.gte:
-                                        _cond.update({'$gte': value})
-                                    elif item == ff.lt:
-                                        _cond.update({'$lt': value})
-                                    elif item == ff.lte:
-                                        _cond.update({'$lte': value})
-                                    elif item == ff.contains:
-                                        _cond.update({'$regex': value})
-                                    conditions.update({name: _cond})
-                            if item in (ff.icontains, ff.iexact):
-                                if query_data.get(item):
-                                    raise InvalidParameter(_(''))
-                    # conditions.update({'object_name': {'$ne': ''}})
-                    queryset = queryset.find(conditions)
-                    if queryset:
-                        if ordering:
-                            if ordering.startswith('-'):
-                                queryset = queryset.sort(ordering[1:], -1)
+                                query_data.get(item), refer_value=v)
+                            if item == ff.exact:
+                                conditions.update({name: value})
                             else:
-                                queryset = queryset.sort(ordering)
+                                _cond = dict()
+                                if item == ff.gt:
+                                    _cond.update({'$gt': value})
+                                elif item == ff.gte:
+                                    _cond.update({'$gte': value})
+                                elif item == ff.lt:
+                                    _cond.update({'$lt': value})
+                                elif item == ff.lte:
+                                    _cond.update({'$lte': value})
+                                elif item == ff.contains:
+                                    _cond.update({'$regex': value})
+                                conditions.update({name: _cond})
+                        if item in (ff.icontains, ff.iexact):
+                            if query_data.get(item):
+                                raise InvalidParameter(_(''))
+                # conditions.update({'object_name': {'$ne': ''}})
+                self.mongo_filter = conditions
+                queryset = queryset.find(conditions)
+                if queryset:
+                    if ordering:
+                        if ordering.startswith('-'):
+                            queryset = queryset.sort(ordering[1:], -1)
+                        else:
+                            queryset = queryset.sort(ordering)
         return queryset
 
 